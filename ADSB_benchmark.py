@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the ADS-B ingestion pipeline
+"""
+
+from datetime import datetime
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from ADSB_cache import traces_to_columns
+from ADSB_lol_data_parser import (PARSERS, analyze_altitude_changes, day_file_pattern, filter_all_data, filter_files,
+                                  find_busiest_hour)
+from Pipeline_metrics import record
+from Synthetic_traces import generate_day
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def compare_parsers(file_pattern, parsers=tuple(PARSERS)):
+    """
+    Compares the parser backends of filter_all_data on the same files.
+
+    Every backend is run twice, once for the wall time and once under tracemalloc for the peak
+    memory, since tracing slows the run down. The backends must give the same filtered traces.
+
+    :param file_pattern: str, glob pattern of the trace_full files to parse
+    :param parsers: tuple of str, names of the backends in PARSERS to compare
+    :return: dict, per backend the wall time in seconds and the peak traced memory in bytes
+    """
+    files = sorted(glob.glob(file_pattern, recursive=True))
+    results = {}
+    reference = None
+
+    for parser in parsers:
+        start = time.perf_counter()
+        filtered_traces, _ = filter_files(files, parser=parser)
+        wall_time = time.perf_counter() - start
+
+        tracemalloc.start()
+        filter_files(files, parser=parser)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        if reference is None:
+            reference = filtered_traces
+        elif filtered_traces != reference:
+            raise ValueError(f"Parser '{parser}' gives different filtered traces than '{parsers[0]}'")
+
+        results[parser] = {'wall_time': wall_time, 'peak_memory': peak_memory}
+        print(f"{parser:>8}: {len(files) / wall_time:8.1f} files/s, {wall_time:7.2f} s, peak {peak_memory / 1e6:8.1f} MB")
+
+    return results
+
+
+def peak_rss():
+    """Peak resident set size in bytes of this process and of its (finished) worker processes, None if unknown."""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            'workers': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale}
+
+
+def run_benchmark(date='2023.08.10', data_dir='Benchmark/Data', results_file='Benchmark/results.json', generate=True,
+                  aircraft=1000, points_per_trace=500, near_schiphol=0.2, workers=1, parser='json'):
+    """
+    Times every stage of the ADS-B pipeline on a (synthetic) day and appends the results to a JSON file.
+
+    The last run in results_file with the same settings is printed next to the new one, so a
+    regression shows up straight away.
+
+    :param date: str, day in 'YYYY.MM.DD' format
+    :param data_dir: str, root directory of the trace files
+    :param results_file: str, JSON file with the list of all benchmark runs
+    :param generate: bool, write a synthetic day with generate_day first
+    :param aircraft, points_per_trace, near_schiphol: passed on to generate_day
+    :param workers, parser: passed on to filter_all_data
+    :return: dict, results of this run
+    """
+    if generate:
+        generate_day(date, data_dir, aircraft=aircraft, points_per_trace=points_per_trace, near_schiphol=near_schiphol)
+
+    file_pattern = day_file_pattern(date, data_dir)
+    files = glob.glob(file_pattern, recursive=True)
+    stage_times = {}
+
+    with record(date) as metrics:
+        start = time.perf_counter()
+        filtered_traces = filter_all_data(file_pattern, workers=workers, parser=parser)
+        stage_times['filter_all_data'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        columns = traces_to_columns(filtered_traces)
+        stage_times['traces_to_columns'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        events = analyze_altitude_changes(columns)
+        stage_times['analyze_altitude_changes'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        busiest_hour = find_busiest_hour(events)
+        stage_times['find_busiest_hour'] = time.perf_counter() - start
+
+    settings = {'date': date, 'files': len(files), 'points_per_trace': points_per_trace if generate else None,
+                'workers': workers, 'parser': parser}
+    total_time = sum(stage_times.values())
+    result = {
+        'run': datetime.now().isoformat(timespec='seconds'),
+        'settings': settings,
+        'stage_times': stage_times,
+        'files_per_second': len(files) / stage_times['filter_all_data'],
+        'points_per_second': len(files) * points_per_trace / stage_times['filter_all_data'] if generate else None,
+        'points_kept': len(columns['timestamp']),
+        'events': len(events),
+        'busiest_hour_total': busiest_hour[3],
+        'total_time': total_time,
+        'peak_rss': peak_rss(),
+        'metrics': metrics.summary(),
+    }
+
+    # Compare with the previous run with the same settings
+    runs = []
+    if os.path.exists(results_file):
+        with open(results_file, 'r', encoding='utf-8') as file:
+            runs = json.load(file)
+    previous = next((run for run in reversed(runs) if run['settings'] == settings), None)
+    previous_times = dict(previous['stage_times'], total=previous['total_time']) if previous else {}
+
+    print(f"\n{'stage':<26}{'now':>10}{'previous':>10}")
+    for stage, stage_time in dict(stage_times, total=total_time).items():
+        previous_time = f"{previous_times[stage]:>9.3f}s" if stage in previous_times else f"{'-':>10}"
+        print(f"{stage:<26}{stage_time:>9.3f}s{previous_time}")
+    print(f"{result['files_per_second']:.1f} files/s, peak RSS {result['peak_rss']}")
+
+    runs.append(result)
+    os.makedirs(os.path.dirname(results_file) or '.', exist_ok=True)
+    with open(results_file, 'w', encoding='utf-8') as file:
+        json.dump(runs, file, indent=4)
+
+    return result
+
+
+if __name__ == '__main__':
+    run_benchmark()
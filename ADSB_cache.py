@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar cache of the filtered ADS-B traces, one .npz file per day
+
+The cache key covers the filter region and the manifest (path, mtime and size) of the raw
+trace files, so a day is filtered again as soon as its data or the bounding box changes.
+"""
+
+import hashlib
+import json
+from operator import itemgetter
+import os
+
+import numpy as np
+
+CACHE_VERSION = 4
+
+
+def file_manifest(files):
+    """List of (path, mtime in ns, size in bytes) for every raw trace file."""
+    manifest = []
+    for file_path in files:
+        stat = os.stat(file_path)
+        manifest.append((file_path, stat.st_mtime_ns, stat.st_size))
+    return manifest
+
+
+def cache_key(files, region):
+    """
+    Hash of everything the filtered traces depend on.
+
+    :param files: list of str, raw trace files of the day
+    :param region: list of (lat, lon), bounding box corners or polygon vertices used for filtering
+    :return: str, hex digest
+    """
+    key_data = {'version': CACHE_VERSION,
+                'region': [[float(lat), float(lon)] for lat, lon in region],
+                'files': file_manifest(files)}
+    return hashlib.sha1(json.dumps(key_data).encode('utf-8')).hexdigest()
+
+
+def traces_to_columns(filtered_traces):
+    """
+    Converts the filtered traces to typed arrays.
+
+    Points are stored back to back, trace_offsets[i]:trace_offsets[i + 1] are the points of trace i.
+    Point timestamps are seconds after the trace_timestamp of their trace, like in the raw files.
+    Altitude is NaN for every point without an integer altitude (on the ground), ground speed and
+    vertical rate are NaN when the point does not have them.
+    Callsigns are only in the details of some points, callsign[i] was seen at point callsign_point[i].
+    """
+    lengths = [len(trace['trace']) for trace in filtered_traces]
+    points = [point for trace in filtered_traces for point in trace['trace']]
+    callsigns = [(i, point[8]['flight'].strip()) for i, point in enumerate(points)
+                 if len(point) > 8 and isinstance(point[8], dict) and point[8].get('flight', '').strip()]
+
+    return {
+        'icao': np.array([trace['icao'] for trace in filtered_traces], dtype=str),
+        'registration': np.array([trace['registration'] or '' for trace in filtered_traces], dtype=str),
+        'trace_timestamp': np.array([trace.get('timestamp', 0) for trace in filtered_traces], dtype=np.float64),
+        'trace_offsets': np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))),
+        'timestamp': np.fromiter(map(itemgetter(0), points), dtype=np.float64, count=len(points)),
+        'lat': np.fromiter(map(itemgetter(1), points), dtype=np.float64, count=len(points)),
+        'lon': np.fromiter(map(itemgetter(2), points), dtype=np.float64, count=len(points)),
+        'altitude': np.fromiter((altitude if isinstance(altitude, int) else np.nan for altitude in map(itemgetter(3), points)),
+                                dtype=np.float64, count=len(points)),
+        'ground_speed': optional_column(points, 4),
+        'vertical_rate': optional_column(points, 7),
+        'callsign_point': np.array([i for i, _ in callsigns], dtype=np.int64),
+        'callsign': np.array([callsign for _, callsign in callsigns], dtype=str),
+    }
+
+
+def optional_column(points, index):
+    """Typed array of a point field that can be null or missing, NaN where it is."""
+    return np.fromiter((point[index] if len(point) > index and point[index] is not None else np.nan for point in points),
+                       dtype=np.float64, count=len(points))
+
+
+def save_day(cache_path, columns, key):
+    """Writes the columns of a day to the cache. Written to a temporary file first so a crash never leaves half a cache."""
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    temporary_path = cache_path + '.tmp'
+    with open(temporary_path, 'wb') as file:
+        np.savez(file, key=np.array(key), **columns)
+    os.replace(temporary_path, cache_path)
+
+
+def load_day(cache_path, key):
+    """Loads the columns of a day from the cache. Returns None if there is no cache or it is stale."""
+    if not os.path.exists(cache_path):
+        return None
+
+    with np.load(cache_path, allow_pickle=False) as cache:
+        if str(cache['key']) != key:
+            return None
+        return {name: cache[name] for name in cache.files if name != 'key'}
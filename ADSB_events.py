@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Compact table of the departure and arrival events found in the ADS-B traces
+"""
+
+from collections import Counter
+
+import numpy as np
+
+# Event codes, EVENT_NAMES[code] is the name used in the printed results
+ARRIVED = 0
+DEPARTED = 1
+EVENT_NAMES = ('arrived', 'departed')
+
+
+class EventTable:
+    """
+    Events as typed columns instead of one dict per event.
+
+    timestamp holds int64 epoch seconds, aircraft int32 ids into the interned icao and registration
+    arrays and event the uint8 event code (ARRIVED or DEPARTED). callsign is the callsign the aircraft
+    broadcast around the event ('' if unknown). suppressed counts the transitions that were rejected
+    by the movement detection, per reason.
+    """
+
+    __slots__ = ('timestamp', 'aircraft', 'event', 'icao', 'registration', 'callsign', 'suppressed')
+
+    def __init__(self, timestamp, aircraft, event, icao, registration, suppressed=None, callsign=None):
+        self.timestamp = np.asarray(timestamp, dtype=np.int64)
+        self.aircraft = np.asarray(aircraft, dtype=np.int32)
+        self.event = np.asarray(event, dtype=np.uint8)
+        self.icao = np.asarray(icao, dtype=str)
+        self.registration = np.asarray(registration, dtype=str)
+        self.callsign = np.asarray(callsign if callsign is not None else [''] * len(self.timestamp), dtype=str)
+        self.suppressed = Counter(suppressed)
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def take(self, indices):
+        """New table with only the events at indices (an index array or boolean mask), in that order."""
+        return EventTable(self.timestamp[indices], self.aircraft[indices], self.event[indices], self.icao, self.registration,
+                          self.suppressed, self.callsign[indices])
+
+    def sorted(self):
+        """New table with the events sorted by time."""
+        return self.take(np.argsort(self.timestamp, kind='stable'))
+
+    def counts(self):
+        """Number of arrivals and departures."""
+        arrivals, departures = np.bincount(self.event, minlength=len(EVENT_NAMES))
+        return int(arrivals), int(departures)
+
+    def records(self):
+        """The events as dicts, like the event lists of the original analysis. Only meant for inspecting a few events."""
+        for timestamp, aircraft, event, callsign in zip(self.timestamp.tolist(), self.aircraft.tolist(), self.event.tolist(),
+                                                        self.callsign.tolist()):
+            yield {'timestamp': timestamp,
+                   'icao': str(self.icao[aircraft]),
+                   'registration': str(self.registration[aircraft]) or None,
+                   'callsign': callsign or None,
+                   'event': EVENT_NAMES[event]}
+
+    @classmethod
+    def concatenate(cls, tables):
+        """Joins the events of several tables, the aircraft are interned again by icao."""
+        icao = np.concatenate([table.icao for table in tables])
+        registration = np.concatenate([table.registration for table in tables])
+        unique_icao, first, inverse = np.unique(icao, return_index=True, return_inverse=True)
+
+        offsets = np.cumsum([0] + [len(table.icao) for table in tables[:-1]])
+        aircraft = np.concatenate([inverse[offset + table.aircraft] for offset, table in zip(offsets, tables)])
+
+        return cls(np.concatenate([table.timestamp for table in tables]), aircraft,
+                   np.concatenate([table.event for table in tables]), unique_icao, registration[first],
+                   sum((table.suppressed for table in tables), Counter()),
+                   np.concatenate([table.callsign for table in tables]))
@@ -6,13 +6,28 @@ Probeersel om ADSB.lol data te verwerken
 """
 
 from collections import Counter
-from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from functools import partial
 import json
 import glob
 import gzip
+import os
+from operator import itemgetter
+import re
 import sys
 import random
 
+import numpy as np
+
+from Airports import AIRPORTS
+from ADSB_cache import cache_key, load_day, save_day, traces_to_columns
+from ADSB_events import ARRIVED, DEPARTED, EventTable
+from Epoch_time import LOCAL_TIMEZONE, to_datetime
+from Pipeline_metrics import Metrics, active_metrics, instrumented, record
+from Sliding_window import busiest_windows
+from Trace_index import build_index, query_index
+
 # Define the bounding box around Schiphol
 """
 52.392124353727276,4.84323226670213
@@ -22,8 +37,7 @@ import random
 
 """
 
-bbox_top_left = (52.392124353727276, 4.65390042931)
-bbox_bottom_right = (52.2632215325, 4.84323226670213)
+bbox_top_left, bbox_bottom_right = AIRPORTS['EHAM'].bbox
 
 
 def is_within_bbox(lat, lon, bbox_tl, bbox_br):
@@ -31,47 +45,262 @@ def is_within_bbox(lat, lon, bbox_tl, bbox_br):
     return bbox_tl[0] >= lat >= bbox_br[0] and bbox_tl[1] <= lon <= bbox_br[1]
 
 
-def filter_trace(trace):
-    """Filter the trace to keep only points within the bounding box."""
-    filtered_trace = [point for point in trace if is_within_bbox(point[1], point[2], bbox_top_left, bbox_bottom_right)]
-    return filtered_trace
+def bbox_mask(lat, lon, bbox_tl, bbox_br):
+    """Vectorized is_within_bbox, checks all points of a trace in one operation."""
+    return (bbox_tl[0] >= lat) & (lat >= bbox_br[0]) & (bbox_tl[1] <= lon) & (lon <= bbox_br[1])
+
+
+def polygon_bbox(polygon):
+    """Bounding box (top left, bottom right) of a polygon given as a list of (lat, lon) vertices."""
+    vertices = np.asarray(polygon, dtype=np.float64)
+    return (vertices[:, 0].max(), vertices[:, 1].min()), (vertices[:, 0].min(), vertices[:, 1].max())
+
 
+def polygon_mask(lat, lon, polygon):
+    """Even-odd ray casting test of all points against a polygon given as a list of (lat, lon) vertices."""
+    vertices = np.asarray(polygon, dtype=np.float64)
+    inside = np.zeros(len(lat), dtype=bool)
 
-def filter_all_data(file_pattern, output_to_json=False):
+    for (lat1, lon1), (lat2, lon2) in zip(vertices, np.roll(vertices, -1, axis=0)):
+        crosses = (lat1 > lat) != (lat2 > lat)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lon_crossing = lon1 + (lat - lat1) * (lon2 - lon1) / (lat2 - lat1)
+        inside ^= crosses & (lon < lon_crossing)
+
+    return inside
+
+
+def region_bbox(polygon=None):
+    """Bounding box (top left, bottom right) to filter on, the Schiphol box or the box around the polygon."""
+    return (bbox_top_left, bbox_bottom_right) if polygon is None else polygon_bbox(polygon)
+
+
+def filter_trace(trace, polygon=None):
+    """
+    Filter the trace to keep only points within the bounding box, or within the polygon if one is given
+    (e.g. a runway zone geofence as a list of (lat, lon) vertices).
+    """
+    if not trace:
+        return []
+
+    if polygon is None:
+        bbox_tl, bbox_br = bbox_top_left, bbox_bottom_right
+    else:
+        bbox_tl, bbox_br = polygon_bbox(polygon)
+
+    lat = np.fromiter(map(itemgetter(1), trace), dtype=np.float64, count=len(trace))
+    lon = np.fromiter(map(itemgetter(2), trace), dtype=np.float64, count=len(trace))
+
+    # Skip the per point work if the extent of the trace cannot intersect the box
+    if lat.max() < bbox_br[0] or lat.min() > bbox_tl[0] or lon.max() < bbox_tl[1] or lon.min() > bbox_br[1]:
+        return []
+
+    indices = np.flatnonzero(bbox_mask(lat, lon, bbox_tl, bbox_br))
+    if polygon is not None:
+        indices = indices[polygon_mask(lat[indices], lon[indices], polygon)]
+
+    return [trace[i] for i in indices]
+
+
+def load_trace_json(file_path, metrics):
+    """Decompress and decode a whole trace_full file, the trace array is data['trace']."""
+    with metrics.timer('decompress'):
+        with gzip.open(file_path, 'rb') as file:
+            raw = file.read()
+    metrics.count('bytes decompressed', len(raw))
+
+    with metrics.timer('json parse'):
+        data = json.loads(raw)
+    metrics.count('points scanned', len(data['trace']))
+    return data
+
+
+def parse_trace_json(file_path, polygon=None, metrics=None):
+    """Parser backend that loads the whole file with json.loads and filters the trace afterwards."""
+    metrics = metrics if metrics is not None else Metrics()
+    data = load_trace_json(file_path, metrics)
+
+    # Filter the trace for points within the bounding box
+    with metrics.timer('filter'):
+        filtered_trace = filter_trace(data['trace'], polygon)
+    return data['icao'], data.get('r', None), data.get('timestamp', 0), filtered_trace
+
+
+# A trace point starts with [timestamp, lat, lon, ... the nested details never contain three numbers in a row
+TRACE_START = re.compile(r'"trace"\s*:\s*\[')
+POINT_HEAD = re.compile(r'\[\s*(-?[\d.]+(?:[eE][-+]?\d+)?)\s*,\s*(-?[\d.]+(?:[eE][-+]?\d+)?)\s*,\s*(-?[\d.]+(?:[eE][-+]?\d+)?)\s*,')
+HEADER_FIELD = re.compile(r'"(icao|r)"\s*:\s*"([^"]*)"')
+HEADER_TIMESTAMP = re.compile(r'"timestamp"\s*:\s*(-?[\d.]+(?:[eE][-+]?\d+)?)')
+MAX_POINT_HEAD_LENGTH = 128
+STREAM_CHUNK_SIZE = 1 << 16
+
+
+def parse_trace_stream(file_path, polygon=None, metrics=None):
+    """
+    Parser backend that walks the trace array incrementally from the gzip stream.
+
+    Only the lat/lon at the head of every point is read, a point is decoded into a list only if it
+    is inside the bounding box (and polygon). Assumes readsb's layout where icao, r and timestamp are
+    written before the trace array. Decompressing and parsing are interleaved, so they are timed
+    together as 'stream parse'.
+    """
+    metrics = metrics if metrics is not None else Metrics()
+    if polygon is None:
+        bbox_tl, bbox_br = bbox_top_left, bbox_bottom_right
+    else:
+        bbox_tl, bbox_br = polygon_bbox(polygon)
+    decoder = json.JSONDecoder()
+
+    with metrics.timer('stream parse'), gzip.open(file_path, 'rt', encoding='utf-8') as file:
+        # Read the header up to the start of the trace array
+        buffer = ''
+        while (trace_start := TRACE_START.search(buffer)) is None:
+            chunk = file.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                raise ValueError("No trace array found")
+            buffer += chunk
+        header = dict(HEADER_FIELD.findall(buffer, 0, trace_start.start()))
+        header_timestamp = HEADER_TIMESTAMP.search(buffer, 0, trace_start.start())
+        buffer = buffer[trace_start.end():]
+
+        filtered_trace = []
+        points_scanned = 0
+        at_end = False
+        while True:
+            position = 0
+            for point_head in POINT_HEAD.finditer(buffer):
+                lat, lon = float(point_head[2]), float(point_head[3])
+                if not is_within_bbox(lat, lon, bbox_tl, bbox_br) or (
+                        polygon is not None and not polygon_mask(np.array([lat]), np.array([lon]), polygon)[0]):
+                    position = point_head.end()
+                    points_scanned += 1
+                    continue
+
+                try:
+                    point, position = decoder.raw_decode(buffer, point_head.start())
+                except json.JSONDecodeError:
+                    if at_end:
+                        raise
+                    # The point continues in the next chunk
+                    position = point_head.start()
+                    break
+                filtered_trace.append(point)
+                points_scanned += 1
+            else:
+                # Keep the tail in case a point head is cut off at the end of the chunk
+                position = max(position, len(buffer) - MAX_POINT_HEAD_LENGTH)
+
+            if at_end:
+                break
+            chunk = file.read(STREAM_CHUNK_SIZE)
+            at_end = not chunk
+            buffer = buffer[position:] + chunk
+
+        # The underlying GzipFile is at the end of the decompressed data
+        metrics.count('bytes decompressed', file.buffer.tell())
+    metrics.count('points scanned', points_scanned)
+
+    return header['icao'], header.get('r', None), float(header_timestamp[1]) if header_timestamp else 0, filtered_trace
+
+
+PARSERS = {'json': parse_trace_json, 'stream': parse_trace_stream}
+
+
+def read_trace_file(file_path, polygon=None, parser='json', metrics=None):
+    """Open, decompress and filter one trace_full file. Returns None if no points are near Schiphol."""
+    metrics = metrics if metrics is not None else Metrics()
+    icao, registration, timestamp, filtered_trace = PARSERS[parser](file_path, polygon, metrics)
+    metrics.count('points kept', len(filtered_trace))
+    if not filtered_trace:
+        return None
+
+    # Save only the filtered trace points, their timestamps are seconds after the timestamp of the file
+    return {'icao': icao, 'registration': registration, 'timestamp': timestamp, 'trace': filtered_trace}
+
+
+def filter_files(file_paths, polygon=None, parser='json'):
+    """
+    Filter a chunk of files. Returns the filtered traces in file order and the Metrics of the chunk,
+    with the number of failed files per exception type in its errors.
+    """
+    filtered_traces = []
+    metrics = Metrics()
+
+    for file_path in file_paths:
+        metrics.count('files')
+        try:
+            filtered_trace = read_trace_file(file_path, polygon, parser, metrics)
+            if filtered_trace:
+                filtered_traces.append(filtered_trace)
+        except json.JSONDecodeError as e:
+            print(f"\nError decoding JSON in {file_path}: {e}", file=sys.stderr)
+            metrics.errors[type(e).__name__] += 1
+        except Exception as e:
+            print(f"\nAn error occurred with file {file_path}: {e}", file=sys.stderr)
+            metrics.errors[type(e).__name__] += 1
+
+    return filtered_traces, metrics
+
+
+def print_progress(files_done, total_files):
+    print(f"\rProcessing file {files_done} of {total_files}...", end='')
+    sys.stdout.flush()
+
+
+@instrumented('filter_all_data', lambda filtered_traces: {'planes kept': len(filtered_traces)})
+def filter_all_data(file_pattern, output_to_json=False, workers=1, chunk_size=250, polygon=None, parser='json',
+                    index_path=None):
+    """
+    Filter all trace files matching the pattern for points near Schiphol.
+
+    With workers > 1 the file list is split into chunks of chunk_size files which are filtered
+    by a process pool. The chunks are merged in file order, so the result is the same as with
+    a single process. Progress is reported after every chunk.
+    A polygon of (lat, lon) vertices can be given to filter on instead of the Schiphol bounding box.
+    parser selects the backend from PARSERS: 'json' loads every file completely, 'stream' only
+    decodes the points inside the box.
+    With index_path only the files that pass through the box according to the Trace_index sidecar
+    index are opened, the index is built or updated first.
+    """
     # Find all files matching the pattern
-    files = list(glob.glob(file_pattern, recursive=True))
+    if index_path is None:
+        files = sorted(glob.glob(file_pattern, recursive=True))
+    else:
+        index = build_index(file_pattern, index_path, workers, chunk_size)
+        files = query_index(index, *region_bbox(polygon))
+        active_metrics().count('files skipped by index', len(index['path']) - len(files))
     total_files = len(files)
 
-    # Select % of the files randomly for processing
+    # Select % of the files randomly for processing, kept in file order so every run merges the same way
     percentage_to_process = 1
-    files_to_process = random.sample(files, int(total_files * percentage_to_process))
+    files_to_process = sorted(random.sample(files, int(total_files * percentage_to_process)))
+    chunks = [files_to_process[i:i + chunk_size] for i in range(0, len(files_to_process), chunk_size)]
 
     # Initialize a list to hold filtered trace data
     filtered_traces = []
-
-    # Process each selected file
-    for i, file_path in enumerate(files_to_process, start=1):
-        # Open, decompress, and read each JSON file
-        with gzip.open(file_path, 'rt', encoding='utf-8') as file:
-            try:
-                data = json.load(file)
-                # Filter the trace for points within the bounding box
-                filtered_trace = filter_trace(data['trace'])
-                if filtered_trace:
-                    # Save only the filtered trace points
-                    filtered_traces.append({'icao': data['icao'], 'registration': data.get('r', None), 'trace': filtered_trace})
-            except json.JSONDecodeError as e:
-                print(f"\nError decoding JSON in {file_path}: {e}", file=sys.stderr)
-            except Exception as e:
-                print(f"\nAn error occurred with file {file_path}: {e}", file=sys.stderr)
-
-        # Print progress every 250 files
-        if i % 250 == 0:
-            print(f"\rProcessing file {i} of {len(files_to_process)}...", end='')
-            sys.stdout.flush()
-
-    print(f"\rProcessing file {i} of {len(files_to_process)}...", end='')
+    metrics = Metrics()
+    files_done = 0
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunk_results = executor.map(partial(filter_files, polygon=polygon, parser=parser), chunks)
+            for chunk, (chunk_traces, chunk_metrics) in zip(chunks, chunk_results):
+                filtered_traces.extend(chunk_traces)
+                metrics.merge(chunk_metrics)
+                files_done += len(chunk)
+                print_progress(files_done, len(files_to_process))
+    else:
+        for chunk in chunks:
+            chunk_traces, chunk_metrics = filter_files(chunk, polygon, parser)
+            filtered_traces.extend(chunk_traces)
+            metrics.merge(chunk_metrics)
+            files_done += len(chunk)
+            print_progress(files_done, len(files_to_process))
+
+    active_metrics().merge(metrics)
     print(f"\nFiltered {len(filtered_traces)} planes with points near Schiphol.")
+    if metrics.errors:
+        print(f"Skipped {sum(metrics.errors.values())} files with errors: {dict(metrics.errors)}", file=sys.stderr)
 
     if output_to_json:
         # Save the filtered trace data to a JSON file
@@ -84,114 +313,265 @@ def filter_all_data(file_pattern, output_to_json=False):
     return filtered_traces
 
 
-# %%
+def day_file_pattern(date, data_dir='Data'):
+    """Pattern to match all relevant gzip-compressed JSON files in subdirectories of a day."""
+    return f'{data_dir}/{date}/v{date}-planes-readsb-prod-0/traces/**/trace_full_*.json'
 
 
-def analyze_altitude_changes(filtered_traces):
-    events = []  # List to hold departure and arrival events
+def day_key(date, polygon=None):
+    """Hash of the filter region and the raw files of a day, changes whenever the day has to be filtered again."""
+    files = sorted(glob.glob(day_file_pattern(date), recursive=True))
+    region = [bbox_top_left, bbox_bottom_right] if polygon is None else polygon
+    return cache_key(files, region)
 
-    for trace in filtered_traces:
-        previous_state = None  # Track the previous state (airborne or ground)
-        for point in trace['trace']:
-            timestamp, icao, _, altitude = point[0], trace['icao'], point[2], point[3]
-            current_state = 'airborne' if isinstance(altitude, int) else 'ground'
-            # TODO: Gebeurt het ooit dat er geen altitude wordt gegeven, zonder dat het vliegtuig werkelijk op de grond staat?
-            # TODO: Als hier 1 foutieve status uit komt zorgt het voor 2 extra gemeten bewegingen
-            # Check for a state change (either from ground to airborne or vice versa)
-            if previous_state and previous_state != current_state:
-                event_type = 'departed' if current_state == 'airborne' else 'arrived'
-                events.append({
-                    'timestamp': timestamp,
-                    'icao': icao,
-                    'registration': trace.get('registration', None),
-                    'event': event_type
-                })
 
-            previous_state = current_state
+def load_or_filter_day(date, cache_dir='Cache', workers=1, polygon=None, parser='json', use_index=False):
+    """
+    Load the filtered traces of a day as columns (see traces_to_columns) from the cache, or filter the
+    raw files and cache them.
 
-    return events
+    The cache is invalidated automatically when the bounding box, the polygon or any raw file changes.
+    With use_index the raw files are filtered through the sidecar index <cache_dir>/<date>.index.npz,
+    which survives a change of the box or polygon.
+    """
+    file_pattern = day_file_pattern(date)
+    key = day_key(date, polygon)
+    cache_path = os.path.join(cache_dir, f'{date}.npz')
 
+    columns = load_day(cache_path, key)
+    if columns is not None:
+        active_metrics().count('days from cache')
+        print(f"Loaded {len(columns['icao'])} planes with points near Schiphol from {cache_path}")
+        return columns
 
-def print_total_movements(events):
-    # Initialize counters for arrivals and departures
-    arrivals_count = 0
-    departures_count = 0
+    index_path = os.path.join(cache_dir, f'{date}.index.npz') if use_index else None
+    columns = traces_to_columns(filter_all_data(file_pattern, workers=workers, polygon=polygon, parser=parser,
+                                                index_path=index_path))
+    save_day(cache_path, columns, key)
+    return columns
 
-    # Loop through the events to count arrivals and departures
-    for event in events:
-        if event['event'] == 'arrived':
-            arrivals_count += 1
-        elif event['event'] == 'departed':
-            departures_count += 1
+
+# %%
+
+
+SCHIPHOL_RUNWAY_ZONES = AIRPORTS['EHAM'].geofence
+
+
+@instrumented('analyze_altitude_changes',
+              lambda events: dict(events=len(events), **{f'suppressed {reason}': n for reason, n in events.suppressed.items()}))
+def analyze_altitude_changes(filtered_traces, min_points=3, min_seconds=20, max_taxi_speed=50, min_vertical_rate=1000,
+                             geofence=None):
+    """
+    Find the departures and arrivals as debounced changes between airborne and ground.
+
+    Accepts the filtered traces as a list (filter_all_data) or as columns (load_or_filter_day). All
+    points are handled in one vectorized pass:
+    - A point is airborne if it has an integer altitude. Airborne points slower than max_taxi_speed
+      (kt) count as ground and ground points climbing or descending faster than min_vertical_rate
+      (ft/min) as airborne, if the point has a ground speed or vertical rate.
+    - The points are split into runs of the same state. A run is only accepted as a new state if it
+      lasts at least min_points points and min_seconds seconds, shorter runs are noise and keep the
+      previous state. One spurious altitude no longer gives two phantom movements.
+    - With geofence (a list of polygons, e.g. SCHIPHOL_RUNWAY_ZONES) only transitions on one of the
+      polygons are movements.
+
+    min_points=1, min_seconds=0 and max_taxi_speed=min_vertical_rate=None give the raw transitions.
+    The number of rejected transitions per reason is in the suppressed counter of the result.
+    """
+    columns = filtered_traces if isinstance(filtered_traces, dict) else traces_to_columns(filtered_traces)
+    offsets = columns['trace_offsets']
+    point_count = len(columns['altitude'])
+    if point_count == 0:
+        return EventTable([], [], [], [], [])
+
+    # State of every point, refined with ground speed and vertical rate where known
+    airborne = ~np.isnan(columns['altitude'])
+    if max_taxi_speed is not None:
+        airborne &= ~(columns['ground_speed'] < max_taxi_speed)
+    if min_vertical_rate is not None:
+        airborne |= np.abs(columns['vertical_rate']) >= min_vertical_rate
+
+    # Runs of the same state, a new run also starts at the first point of every trace
+    run_start_mask = np.zeros(point_count, dtype=bool)
+    run_start_mask[offsets[:-1][offsets[:-1] < point_count]] = True
+    run_start_mask[1:] |= airborne[1:] != airborne[:-1]
+    run_starts = np.flatnonzero(run_start_mask)
+    run_ends = np.append(run_starts[1:], point_count)
+    run_trace = np.searchsorted(offsets, run_starts, side='right') - 1
+    first_in_trace = np.append(True, run_trace[1:] != run_trace[:-1])
+    last_in_trace = np.append(first_in_trace[1:], True)
+
+    # A run lasts until the next run of the trace starts, the last run until the last point of the trace
+    times = np.repeat(columns['trace_timestamp'], np.diff(offsets)) + columns['timestamp']
+    run_end_times = times[np.where(last_in_trace, run_ends - 1, np.minimum(run_ends, point_count - 1))]
+    run_durations = run_end_times - times[run_starts]
+    run_states = airborne[run_starts]
+    stable = ((run_ends - run_starts) >= min_points) & (run_durations >= min_seconds)
+
+    # Previous stable run of the same trace for every run
+    run_indices = np.arange(len(run_starts))
+    last_stable = np.maximum.accumulate(np.where(stable, run_indices, -1))
+    previous_stable = np.append(-1, last_stable[:-1])
+    first_run_of_trace = np.maximum.accumulate(np.where(first_in_trace, run_indices, 0))
+    previous_stable[previous_stable < first_run_of_trace] = -1
+
+    # A movement is a stable run with another state than the stable run before it
+    accepted = stable & (previous_stable >= 0) & (run_states != run_states[previous_stable])
+    suppressed = Counter({'debounce': int(np.count_nonzero(~first_in_trace) - np.count_nonzero(accepted))})
+
+    changes = run_starts[accepted]
+    if geofence is not None:
+        on_geofence = np.zeros(len(changes), dtype=bool)
+        for polygon in geofence:
+            on_geofence |= polygon_mask(columns['lat'][changes], columns['lon'][changes], polygon)
+        suppressed['geofence'] = int(np.count_nonzero(~on_geofence))
+        changes = changes[on_geofence]
+
+    # Intern the aircraft, every icao gets one id
+    icao, first_trace, trace_aircraft = np.unique(columns['icao'], return_index=True, return_inverse=True)
+    trace_index = np.searchsorted(offsets, changes, side='right') - 1
+
+    return EventTable(timestamp=np.floor(times[changes]),
+                      aircraft=trace_aircraft[trace_index],
+                      event=np.where(airborne[changes], DEPARTED, ARRIVED),
+                      icao=icao,
+                      registration=columns['registration'][first_trace],
+                      suppressed=suppressed,
+                      callsign=event_callsigns(columns, changes, trace_index))
+
+
+def event_callsigns(columns, changes, trace_index):
+    """Callsign of every change: the last one seen in the trace up to that point, else the first one after it."""
+    callsign_points = columns['callsign_point']
+    if len(callsign_points) == 0:
+        return np.full(len(changes), '')
+
+    offsets = columns['trace_offsets']
+    before = np.searchsorted(callsign_points, changes, side='right') - 1
+    after = before + 1
+    has_before = (before >= 0) & (callsign_points[np.maximum(before, 0)] >= offsets[trace_index])
+    has_after = (after < len(callsign_points)) & (callsign_points[np.minimum(after, len(callsign_points) - 1)] < offsets[trace_index + 1])
+
+    chosen = np.where(has_before, before, after)
+    return np.where(has_before | has_after, columns['callsign'][np.clip(chosen, 0, len(callsign_points) - 1)], '')
+
+
+def print_total_movements(events):
+    # Count arrivals and departures
+    arrivals_count, departures_count = events.counts()
 
     # Print the counts
     print(f"\nArrivals: {arrivals_count}")
     print(f"Departures: {departures_count}")
-    print(f"Total movements: {arrivals_count + departures_count}\n")
+    print(f"Total movements: {arrivals_count + departures_count}")
+    print(f"Suppressed transitions: {dict(events.suppressed)}\n")
 
 
 # %%
 
 
-def find_busiest_hour(events):
-    # Convert timestamps to datetime objects and sort events
-    for event in events:
-        event['timestamp'] = datetime.fromtimestamp(event['timestamp'])
-    events.sort(key=lambda x: x['timestamp'])
+@instrumented('find_busiest_hour')
+def find_busiest_hour(events, window=timedelta(hours=1), timezone=LOCAL_TIMEZONE):
+    """Find the window with the most arrivals and departures added up."""
+    busiest_windows = find_busiest_windows(events, window, top_k=1, timezone=timezone)
+    if not busiest_windows:
+        return None, 0, 0, 0
 
-    # Initialize variables to track the busiest hour
-    busiest_start_time = None
-    busiest_count = 0
-    arrivals_during_busiest = 0
-    departures_during_busiest = 0
+    return busiest_windows[0]
 
-    # Use a moving window to count events in each hour-long period
-    for i, event in enumerate(events):
-        start_time = event['timestamp']
-        end_time = start_time + timedelta(hours=1)
-        window_events = [e for e in events if start_time <= e['timestamp'] < end_time]
 
-        # Count arrivals and departures within the window
-        event_counts = Counter(e['event'] for e in window_events)
-        total_events = sum(event_counts.values())
+def find_busiest_windows(events, window=timedelta(hours=1), top_k=5, timezone=LOCAL_TIMEZONE):
+    """
+    Find the top-K non-overlapping busiest windows.
 
-        # Update the busiest hour if this window has more events
-        if total_events > busiest_count:
-            busiest_count = total_events
-            busiest_start_time = start_time
-            arrivals_during_busiest = event_counts['arrived']
-            departures_during_busiest = event_counts['departed']
+    The event timestamps are sorted once into NumPy arrays and every window is counted
+    with a searchsorted sweep, instead of rescanning all events for every window start.
+    The windows are counted on UTC epoch seconds, only their start is converted to a datetime
+    in timezone ('UTC' or e.g. 'Europe/Amsterdam'), so the result does not depend on the host.
+    """
+    return [(to_datetime(start_time, timezone), arrivals, departures, total)
+            for start_time, arrivals, departures, total
+            in busiest_windows(events.timestamp, events.event == ARRIVED, window.total_seconds(), top_k)]
 
-    return busiest_start_time, arrivals_during_busiest, departures_during_busiest, busiest_count
 
-# %% Main
+def analyze_day(date, workers=1, metrics_dir='Metrics', profile=False, trace_memory=False, timezone=LOCAL_TIMEZONE,
+                use_geofence=False):
+    """
+    Run the whole pipeline for one day and return the busiest hour as a JSON serialisable dict.
 
+    The busiest hour is reported with its date on the clock of timezone, which is not always the
+    (UTC) date of the data directory, 'busiest hour start' is its UTC epoch time. With use_geofence
+    only transitions on the Schiphol runway zones (SCHIPHOL_RUNWAY_ZONES) count.
 
-top_5 = ["2023.08.10", "2023.10.09", "2023.07.14", "2023.07.20", "2023.08.07"]
-results = [["date", 'total movements', 'busiest hour', 'arrivals', 'departures']]
+    The timers and counters of the day are written to <metrics_dir>/<date>.json (see
+    Pipeline_metrics.record), profile and trace_memory turn on cProfile and tracemalloc.
+    """
+    with record(date, metrics_dir, profile, trace_memory):
+        filtered_traces = load_or_filter_day(date, workers=workers)
+        events = analyze_altitude_changes(filtered_traces, geofence=SCHIPHOL_RUNWAY_ZONES if use_geofence else None)
+        busiest_hour_start, arrivals, departures, total_events = find_busiest_hour(events, timezone=timezone)
 
-for date in top_5:
-    # Pattern to match all relevant gzip-compressed JSON files in subdirectories
-    file_pattern = f'Data/{date}/v{date}-planes-readsb-prod-0/traces/**/trace_full_*.json'
-    filtered_traces = filter_all_data(file_pattern)
-    events = analyze_altitude_changes(filtered_traces)
     print_total_movements(events)
-    busiest_hour_start, arrivals, departures, total_events = find_busiest_hour(events)
+    if busiest_hour_start is None:
+        raise ValueError(f"No movements found on {date}")
 
-    results.append([date, total_events, busiest_hour_start.strftime('%H:%M:%S'), arrivals, departures])
     # Print the results
-    # print(f"Busiest hour starts at: {busiest_hour_start.strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"Busiest hour starts at: {busiest_hour_start.strftime('%H:%M:%S')}")
+    print(f"Busiest hour starts at: {busiest_hour_start.strftime('%Y-%m-%d %H:%M:%S %Z')}")
     print(f"Arrivals during busiest hour: {arrivals}")
     print(f"Departures during busiest hour: {departures}")
     print(f"Total events during busiest hour: {total_events}")
 
+    return {'total movements': total_events, 'busiest hour': busiest_hour_start.strftime('%Y-%m-%d %H:%M:%S %Z'),
+            'busiest hour start': int(busiest_hour_start.timestamp()), 'timezone': timezone,
+            'arrivals': arrivals, 'departures': departures}
+
+
+def analyze_days(start_date='2023-01-01', end_date='2023-12-31', workers=1, estimate=False, results_file='results.txt',
+                 checkpoint_path='Checkpoints/adsb_days.jsonl', timezone=LOCAL_TIMEZONE, use_geofence=False):
+    """
+    Find the busiest hour between start_date and end_date (both 'YYYY-MM-DD') with the fewest analysed days.
+
+    Days are analysed from the highest bound of their busiest hour down until no remaining day can
+    beat the best one (see Day_selection). By default only the hard FlightAware bound is used, so the
+    result is exact. With estimate the bound is the schedule maximum plus slack, which prunes far
+    more days but is not guaranteed to hold, a warning is printed when it stopped the search. Every finished
+    day is checkpointed, days that are done and whose raw files did not change are skipped. The
+    analysed days are written to results_file, with the busiest hours on the clock of timezone.
+    use_geofence is passed on to analyze_day.
+    """
+    # pandas is only needed for the bounds
+    from Day_selection import branch_and_bound, day_bounds, load_max_movements
+    from Flightaware_per_hour import load_flightaware
+
+    # Upper bounds of the busiest hour of every day, from the FlightAware totals and the schedules
+    bounds = day_bounds(load_flightaware(), load_max_movements() if estimate else None, start=start_date, end=end_date)
+    results = [["date", 'total movements', 'busiest hour', 'arrivals', 'departures']]
+
+    # Checkpoints written on another clock or with another geofence setting are computed again
+    compute_day = partial(analyze_day, workers=workers, timezone=timezone, use_geofence=use_geofence)
+    settings = f'{timezone}:geofence' if use_geofence else timezone
+    best_day, best_result, day_results, pruned = branch_and_bound(list(bounds), bounds, compute_day,
+                                                                  lambda result: result['total movements'],
+                                                                  checkpoint_path, lambda date: f'{day_key(date)}:{settings}')
+    for date, result in day_results.items():
+        results.append([date, result['total movements'], result['busiest hour'], result['arrivals'], result['departures']])
+    if best_day is not None:
+        print(f"Busiest hour: {best_result['busiest hour']} (data of {best_day}) with {best_result['total movements']} movements")
+    if estimate and pruned:
+        print(f"Warning: {len(pruned)} days were skipped on estimated bounds, the busiest hour is not "
+              f"guaranteed. Run without estimate for an exact result.", file=sys.stderr)
+
+    # Save results to txt. since that is the best format to store data xD
+    with open(results_file, 'w') as file:
+        for item in results:
+            file.write(f"{item}\n")
+
+    print(f"Results have been written to {results_file}")
+    return best_day, best_result
 
-# Save results to txt. since that is the best format to store data xD
-filename = 'results.txt'
 
-with open(filename, 'w') as file:
-    for item in results:
-        file.write(f"{item}\n")
+# %% Main
 
-print(f"Results have been written to {filename}")
+if __name__ == '__main__':
+    # The process pool re-imports this module in every worker on Windows, so the run must be guarded
+    analyze_days('2023-01-01', '2023-12-31', workers=os.cpu_count())
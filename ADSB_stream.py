@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming version of the ADS-B pipeline: files -> filtered traces -> events -> busiest window
+
+Nothing but the events is kept: every file is filtered, turned into events and dropped before the
+next one is read. The events of a day are heap-merged into one time-sorted stream, a day is only
+read once the days before it have been merged up to its start, and an OnlineWindowMax keeps the
+busiest window as the events go by. Busiest windows can therefore cross midnight and a run can span
+many days while only about one day of events is held.
+"""
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import partial
+import glob
+import heapq
+
+from ADSB_events import ARRIVED
+from ADSB_lol_data_parser import analyze_altitude_changes, day_file_pattern, filter_files, region_bbox
+from Epoch_time import LOCAL_TIMEZONE, day_of, to_datetime
+from Pipeline_metrics import active_metrics
+from Sliding_window import OnlineWindowMax
+from Trace_index import build_index, query_index
+
+
+def iter_filtered_traces(file_pattern, polygon=None, parser='json', index_path=None):
+    """Yields the filtered trace of every file with points near Schiphol (or in the polygon), one file at a time."""
+    if index_path is None:
+        files = sorted(glob.glob(file_pattern, recursive=True))
+    else:
+        files = query_index(build_index(file_pattern, index_path), *region_bbox(polygon))
+
+    for file_path in files:
+        filtered_traces, metrics = filter_files([file_path], polygon, parser)
+        active_metrics().merge(metrics)
+        yield from filtered_traces
+
+
+def iter_trace_events(filtered_traces, **detection):
+    """
+    Yields the events of every trace as a time-sorted list of (timestamp, event, icao) tuples.
+
+    :param filtered_traces: iterable of filtered traces, e.g. iter_filtered_traces
+    :param detection: keyword arguments of analyze_altitude_changes (min_points, geofence, ...)
+    """
+    for trace in filtered_traces:
+        events = analyze_altitude_changes([trace], **detection)
+        if len(events):
+            yield [(timestamp, event, trace['icao']) for timestamp, event in zip(events.timestamp.tolist(), events.event.tolist())]
+
+
+def day_events(date, data_dir='Data', polygon=None, parser='json', index_path=None, **detection):
+    """
+    All events of a day as one time-sorted stream, heap-merged from the events of every trace.
+
+    The files of a day are not ordered in time, any of them can hold the first event, so all files
+    are read and turned into events when this is called. Only those events are kept, not the traces.
+    """
+    traces = iter_filtered_traces(day_file_pattern(date, data_dir), polygon, parser, index_path)
+    return heapq.merge(*iter_trace_events(traces, **detection))
+
+
+def day_start(date):
+    """UTC epoch seconds of the start of a day in 'YYYY.MM.DD' format, the data directories are UTC days."""
+    return datetime.strptime(date, '%Y.%m.%d').replace(tzinfo=dt_timezone.utc).timestamp()
+
+
+def merge_event_streams(streams):
+    """
+    Lazily merges time-sorted event streams, e.g. one per day.
+
+    Every stream comes with the earliest time it can contain and is only opened (e.g. its files
+    read) once the streams before it have been merged up to that time. For days only the events of
+    one day and the events of the previous day after midnight are held at a time.
+
+    :param streams: iterable of (start, function returning an iterable of (timestamp, event, icao)),
+        ordered by start, no event of a stream may be earlier than its start
+    :return: generator of (timestamp, event, icao) in time order
+    """
+    heap = []
+
+    def pop():
+        event, order, iterator = heap[0]
+        following = next(iterator, None)
+        if following is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (following, order, iterator))
+        return event
+
+    for order, (start, open_stream) in enumerate(streams):
+        # No stream that is opened later can have events before start
+        while heap and heap[0][0][0] <= start:
+            yield pop()
+
+        iterator = iter(open_stream())
+        first = next(iterator, None)
+        if first is not None:
+            heapq.heappush(heap, (first, order, iterator))
+
+    while heap:
+        yield pop()
+
+
+def stream_busiest_windows(dates, window=timedelta(hours=1), data_dir='Data', timezone=LOCAL_TIMEZONE, **options):
+    """
+    Busiest window over several consecutive days, and the busiest window starting on every day.
+
+    Windows run across midnight into the next day. Memory is bounded by the events of about one day
+    (see merge_event_streams), not by the number of trace points. Windows are grouped per day and
+    reported on the clock of timezone ('UTC' for the days of the data directories).
+
+    :param dates: list of str, consecutive days in 'YYYY.MM.DD' format
+    :param window: timedelta, window length
+    :param options: keyword arguments of day_events (polygon, parser, index_path, detection settings)
+    :return: tuple, (busiest window, dict day -> busiest window starting that day), windows as
+        (start datetime in timezone, arrivals, departures, total) like find_busiest_hour
+    """
+    counter = OnlineWindowMax(window.total_seconds(), day_of=day_of(timezone))
+    events = 0
+    streams = ((day_start(date), partial(day_events, date, data_dir, **options)) for date in dates)
+    for timestamp, event, icao in merge_event_streams(streams):
+        counter.add(timestamp, event == ARRIVED)
+        events += 1
+    active_metrics().count('events streamed', events)
+
+    def as_result(best):
+        start, arrivals, departures, total = best
+        return to_datetime(start, timezone), arrivals, departures, total
+
+    best = counter.finish()
+    return (as_result(best) if best is not None else (None, 0, 0, 0),
+            {day: as_result(day_best) for day, day_best in counter.best_per_day.items()})
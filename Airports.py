@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of the airports the pipeline can analyse
+
+Every airport has a bounding box to filter the trace points on, runway zones as geofence polygons,
+its field elevation and the timezone its schedules are in. Runway thresholds are approximate.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+Airport = namedtuple('Airport', ['icao', 'city', 'bbox', 'runways', 'geofence', 'elevation', 'timezone'])
+
+
+def runway_zone(threshold_a, threshold_b, margin=500):
+    """Rectangle around a runway, extended by margin meters beyond the thresholds and to both sides, as a polygon."""
+    meters_per_degree_lat = 111320
+    meters_per_degree_lon = 111320 * np.cos(np.radians((threshold_a[0] + threshold_b[0]) / 2))
+
+    # Runway direction and its normal in meters
+    a = np.array([threshold_a[0] * meters_per_degree_lat, threshold_a[1] * meters_per_degree_lon])
+    b = np.array([threshold_b[0] * meters_per_degree_lat, threshold_b[1] * meters_per_degree_lon])
+    direction = (b - a) / np.linalg.norm(b - a)
+    normal = np.array([-direction[1], direction[0]])
+
+    corners = [a - margin * direction - margin * normal, b + margin * direction - margin * normal,
+               b + margin * direction + margin * normal, a - margin * direction + margin * normal]
+    return [(float(lat / meters_per_degree_lat), float(lon / meters_per_degree_lon)) for lat, lon in corners]
+
+
+def runways_bbox(runways, margin=3000):
+    """Bounding box (top left, bottom right) around all runway thresholds, extended by margin meters."""
+    thresholds = np.array([threshold for runway in runways.values() for threshold in runway], dtype=np.float64)
+    margin_lat = margin / 111320
+    margin_lon = margin / (111320 * np.cos(np.radians(thresholds[:, 0].mean())))
+    return ((float(thresholds[:, 0].max() + margin_lat), float(thresholds[:, 1].min() - margin_lon)),
+            (float(thresholds[:, 0].min() - margin_lat), float(thresholds[:, 1].max() + margin_lon)))
+
+
+def make_airport(icao, city, runways, elevation, timezone, bbox=None):
+    """Airport with runway zones around all runways as geofence, and a box around the runways if no bbox is given."""
+    return Airport(icao, city, bbox or runways_bbox(runways), runways, [runway_zone(*thresholds) for thresholds in runways.values()],
+                   elevation, timezone)
+
+
+# Approximate (lat, lon) of both thresholds of every Schiphol runway
+SCHIPHOL_RUNWAYS = {
+    '18R/36L': ((52.36286, 4.71172), (52.32858, 4.70894)),
+    '18C/36C': ((52.33139, 4.74006), (52.30039, 4.73764)),
+    '18L/36R': ((52.32144, 4.78016), (52.29089, 4.77753)),
+    '06/24': ((52.28789, 4.73433), (52.30433, 4.77758)),
+    '09/27': ((52.31661, 4.74627), (52.31817, 4.79703)),
+    '04/22': ((52.30039, 4.78306), (52.31394, 4.80256)),
+}
+
+AIRPORTS = {airport.icao: airport for airport in [
+    # Schiphol keeps the bounding box the analysis has always used
+    make_airport('EHAM', 'Amsterdam', SCHIPHOL_RUNWAYS, elevation=-11, timezone='Europe/Amsterdam',
+                 bbox=((52.392124353727276, 4.65390042931), (52.2632215325, 4.84323226670213))),
+    make_airport('EHRD', 'Rotterdam', {'06/24': ((51.9515, 4.4238), (51.9623, 4.4507))}, elevation=-15,
+                 timezone='Europe/Amsterdam'),
+    make_airport('EHEH', 'Eindhoven', {'03/21': ((51.4389, 5.3624), (51.4613, 5.3866))}, elevation=74,
+                 timezone='Europe/Amsterdam'),
+]}
+
+
+def airport_boxes(airports):
+    """Bounding boxes of the airports as arrays (top, left, bottom, right), for testing points against all at once."""
+    boxes = np.array([[airport.bbox[0][0], airport.bbox[0][1], airport.bbox[1][0], airport.bbox[1][1]] for airport in airports],
+                     dtype=np.float64).reshape(-1, 4)
+    return boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent, rate limited page fetcher with an on-disk response cache
+
+The requests are made with one pooled requests.Session from worker threads driven by asyncio,
+so the scrapers keep using requests (and its headers/cookies) while fetching in parallel.
+"""
+
+import asyncio
+from collections import namedtuple
+import os
+import sys
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Same attributes the scrapers use from a requests.Response
+Page = namedtuple('Page', ['url', 'status_code', 'text'])
+
+
+class TokenBucket:
+    """Token bucket rate limiter, allows bursts of capacity requests and rate requests per second on average."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ResponseCache:
+    """Stores the text of every successful response as a file, named after its key (e.g. (type, date, hour))."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def path(self, key):
+        file_name = '_'.join(str(part) for part in key).replace(':', '_').replace('/', '_')
+        return os.path.join(self.cache_dir, f'{file_name}.html')
+
+    def get(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as file:
+            return file.read()
+
+    def put(self, key, text):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(key)
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            file.write(text)
+        os.replace(path + '.tmp', path)
+
+
+def get_with_retries(session, url, retries=3, backoff=2.0, headers=None, timeout=30, before_request=None):
+    """
+    GET a page, retrying connection errors, rate limiting and server errors with exponential backoff.
+
+    :param session: requests.Session, or the requests module itself
+    :param before_request: function called before every attempt (e.g. to wait for the rate limiter), or None
+    :return: requests.Response with status code 200
+    :raises requests.ConnectionError: if the last attempt failed or the page answered with any other status
+    """
+    for attempt in range(retries + 1):
+        if before_request is not None:
+            before_request()
+        try:
+            response = session.get(url, headers=headers() if headers else None, timeout=timeout)
+        except requests.RequestException as e:
+            response, error = None, f"{type(e).__name__}: {e}"
+        else:
+            error = f"HTTP {response.status_code}"
+            # Retry on rate limiting and server errors, client errors will not get better
+            if response.status_code == 200 or (response.status_code != 429 and response.status_code < 500):
+                break
+        if attempt < retries:
+            print(f"\nRetrying {url} after {error}", file=sys.stderr)
+            time.sleep(backoff * 2 ** attempt)
+
+    if response is None or response.status_code != 200:
+        raise requests.ConnectionError(f"Failed to fetch {url}: {error}")
+    return response
+
+
+async def fetch_pages(page_requests, cache=None, concurrency=4, rate=1.0, retries=3, backoff=2.0, headers=None, timeout=30):
+    """
+    Fetches all pages concurrently, taking them from the cache when possible.
+
+    Every page is fetched with get_with_retries in a worker thread, so a page that still fails after
+    the retries raises requests.ConnectionError instead of coming back as an error page.
+
+    :param page_requests: list of (key, url), key identifies the page in the cache
+    :param cache: ResponseCache or None
+    :param concurrency: int, maximum number of requests in flight
+    :param rate: float, maximum average number of requests per second
+    :param retries: int, number of retries after a failed request
+    :param backoff: float, seconds to wait before the first retry, doubled every retry
+    :param headers: function returning a header dict for every request, or None
+    :param timeout: float, timeout of a single request in seconds
+    :return: dict, key -> Page, all with status code 200
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    bucket = TokenBucket(rate)
+    loop = asyncio.get_running_loop()
+
+    def wait_for_token():
+        # Called from the worker thread, the bucket lives on the event loop
+        asyncio.run_coroutine_threadsafe(bucket.acquire(), loop).result()
+
+    with requests.Session() as session:
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        async def fetch(key, url):
+            if cache is not None:
+                text = cache.get(key)
+                if text is not None:
+                    return key, Page(url, 200, text)
+
+            async with semaphore:
+                response = await asyncio.to_thread(get_with_retries, session, url, retries, backoff, headers, timeout, wait_for_token)
+
+            if cache is not None:
+                cache.put(key, response.text)
+            return key, Page(url, response.status_code, response.text)
+
+        pages = await asyncio.gather(*(fetch(key, url) for key, url in page_requests))
+
+    return dict(pages)
+
+
+def fetch_all(page_requests, **kwargs):
+    """Blocking wrapper around fetch_pages, takes the same arguments."""
+    return asyncio.run(fetch_pages(page_requests, **kwargs))
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Resumable per-day runs with an append-only JSONL checkpoint file
+
+Every finished day is written to the checkpoint file straight away, so a crash only loses the
+day that was being computed. On a restart the days that are already done are skipped.
+"""
+
+from datetime import datetime, timedelta
+import json
+import os
+import sys
+
+
+def date_range(start_date, end_date, date_format='%Y-%m-%d'):
+    """
+    Creates a list of date strings for all days from start_date up to and including end_date.
+
+    :param start_date: datetime.date, first day
+    :param end_date: datetime.date, last day
+    :param date_format: str, strftime format of the date strings
+    :return: list of str
+    """
+    return [(start_date + timedelta(days=i)).strftime(date_format) for i in range((end_date - start_date).days + 1)]
+
+
+def load_checkpoints(checkpoint_path):
+    """
+    Reads the checkpoint file. Later lines win, so a recomputed day simply gets appended.
+
+    :param checkpoint_path: str, path of the JSONL checkpoint file
+    :return: dict, day -> {'day', 'key', 'result', 'finished'}
+    """
+    checkpoints = {}
+    if not os.path.exists(checkpoint_path):
+        return checkpoints
+
+    with open(checkpoint_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Half written line of a run that crashed
+            checkpoints[record['day']] = record
+
+    return checkpoints
+
+
+def append_checkpoint(checkpoint_path, day, result, key=None):
+    """Appends the result of one day to the checkpoint file and flushes it to disk."""
+    record = {'day': day, 'key': key, 'result': result, 'finished': datetime.now().isoformat(timespec='seconds')}
+    os.makedirs(os.path.dirname(checkpoint_path) or '.', exist_ok=True)
+    with open(checkpoint_path, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(record) + '\n')
+        file.flush()
+        os.fsync(file.fileno())
+    return record
+
+
+def run_days(days, compute_day, checkpoint_path, day_key=None):
+    """
+    Runs compute_day for every day that is not in the checkpoint file yet, or whose input changed.
+
+    A day that raises an exception is reported and skipped, it is computed again on the next run.
+
+    :param days: list of str, days to process in order
+    :param compute_day: function, day -> JSON serialisable result
+    :param checkpoint_path: str, path of the JSONL checkpoint file
+    :param day_key: function, day -> str identifying the input of that day (e.g. a file manifest hash). None if the input never changes
+    :return: generator of (day, result) for every finished day, both from the checkpoints and newly computed
+    """
+    checkpoints = load_checkpoints(checkpoint_path)
+
+    for day in days:
+        key = day_key(day) if day_key else None
+        record = checkpoints.get(day)
+
+        if record is None or record['key'] != key:
+            try:
+                result = compute_day(day)
+            except Exception as e:
+                print(f"\nFailed to process {day}: {type(e).__name__}: {e}", file=sys.stderr)
+                continue
+            record = append_checkpoint(checkpoint_path, day, result, key)
+            checkpoints[day] = record
+
+        yield day, record['result']
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Branch-and-bound search for the day with the busiest hour, so the costly ADS-B analysis only runs on
+days that can still win
+
+Days are ranked by a cheap upper bound of their busiest hour and analysed in that order. As soon as
+the bound of the next day is not above the best hour found so far, no remaining day can win.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from Day_checkpoints import run_days
+
+
+def load_max_movements(file_path='max_movement_per_day.json'):
+    """
+    Reads the busiest hour per day found in the Dutch Plane Spotters schedules.
+
+    :param file_path: str, JSON of 'YYYY-MM-DD HH:MM' -> movements in the hour starting then
+    :return: pd.Series, movements indexed by the date as datetime64
+    """
+    with open(file_path, 'r') as file:
+        data = json.load(file)
+
+    max_movements = pd.Series(data, dtype=np.int64)
+    max_movements.index = pd.to_datetime(max_movements.index).normalize()
+    return max_movements
+
+
+def day_bounds(flightaware_stats, max_movements=None, slack=0.15, start=None, end=None):
+    """
+    Upper bound of the busiest hour of every day, keyed by the day in the ADS-B 'YYYY.MM.DD' format.
+
+    The FlightAware daily total is a hard bound: an hour never has more movements than its day. It
+    is also far too loose to prune anything, so where the schedule maximum of max_movement_per_day.json
+    is known the bound is that maximum plus slack (a fraction) for flights that were off schedule.
+    That bound is an estimate, with max_movements=None the search is exact but visits every day.
+
+    :param flightaware_stats: pd.DataFrame, result of Flightaware_per_hour.load_flightaware
+    :param max_movements: pd.Series, result of load_max_movements, or None
+    :param slack: float, margin on top of the schedule maximum
+    :param start: str or datetime, first day, None for the first day in the data
+    :param end: str or datetime, last day, None for the last day in the data
+    :return: dict, day -> bound
+    """
+    bounds = flightaware_stats.loc[start:end, 'total'].astype(np.float64)
+    if max_movements is not None:
+        estimate = np.ceil(max_movements.reindex(bounds.index) * (1 + slack))
+        bounds = np.fmin(bounds, estimate)
+    return {date.strftime('%Y.%m.%d'): float(bound) for date, bound in bounds.items()}
+
+
+def branch_and_bound(days, bounds, compute_day, score, checkpoint_path, day_key=None):
+    """
+    Finds the day with the highest score while computing as few days as possible.
+
+    Days are computed from the highest bound down (days without a bound first) through run_days,
+    so finished days come from the checkpoints. The search stops when the bound of the next day is
+    not above the best score so far. Days that fail are skipped like in run_days.
+
+    :param days: list of str, candidate days
+    :param bounds: dict, day -> upper bound of its score
+    :param compute_day: function, day -> JSON serialisable result
+    :param score: function, result -> number to maximise, e.g. the busiest hour total
+    :param checkpoint_path: str, path of the JSONL checkpoint file
+    :param day_key: function, day -> str identifying the input of that day, or None
+    :return: tuple, (best day, its result, dict day -> result of every computed day, list of the
+        days the bound stopped the search before, highest bound first)
+    """
+    ordered = sorted(days, key=lambda day: -bounds.get(day, np.inf))
+    position = {day: i for i, day in enumerate(ordered)}
+    best_day, best_result, results, pruned = None, None, {}, []
+
+    for day, result in run_days(ordered, compute_day, checkpoint_path, day_key):
+        results[day] = result
+        if best_result is None or score(result) > score(best_result):
+            best_day, best_result = day, result
+
+        remaining = ordered[position[day] + 1:]
+        if not remaining or bounds.get(remaining[0], np.inf) <= score(best_result):
+            print(f"Stopped after {len(results)} of {len(ordered)} days, no remaining day can beat "
+                  f"{score(best_result)} on {best_day}")
+            pruned = remaining
+            break
+
+    return best_day, best_result, results, pruned
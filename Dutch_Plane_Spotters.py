@@ -1,73 +1,226 @@
-import matplotlib
-matplotlib.use('TkAgg')
-import matplotlib.pyplot as plt
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from io import StringIO
+import json
+import os
+import sys
+
 import pandas as pd
-from datetime import datetime, time, timedelta
+from datetime import datetime, timedelta
 import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from Async_fetcher import ResponseCache, get_with_retries
+from Day_checkpoints import append_checkpoint, date_range, load_checkpoints
+from Epoch_time import LOCAL_TIMEZONE, format_times, schedule_epochs
+from Sliding_window import hhmm_to_minutes, window_counts
+
+DPS_HOST = "https://schiphol.dutchplanespotters.nl"
+DPS_PAGES = {'arrival': '/?date=', 'departure': '/departures.php?date='}
+# The schedules are Schiphol times
+SCHEDULE_TIMEZONE = LOCAL_TIMEZONE
+
+
+def fetch_html(date: str, direction: str, cache=None, session=None, host=DPS_HOST, retries=3, backoff=2.0, timeout=30):
+    """
+    Raw HTML of the arrival or departure page of a date, from the cache if it is there.
+
+    Saved pages can be used as fixtures by putting them in the cache directory as <direction>_<date>.html.
+    """
+    key = (direction, date)
+    if cache is not None:
+        html = cache.get(key)
+        if html is not None:
+            return html
+
+    response = get_with_retries(session if session is not None else requests, host + DPS_PAGES[direction] + date,
+                                retries, backoff, timeout=timeout)
+    if cache is not None:
+        cache.put(key, response.text)
+    return response.text
+
+
+def parse_flightdata(arrival_html, departure_html):
+    arrival_table = pd.read_html(StringIO(arrival_html))[0]['Arrival']
+    departure_table = pd.read_html(StringIO(departure_html))[0]
+
+    arrivals = pd.DataFrame({'time': arrival_table['ETA'], 'flight': arrival_table['FLIGHTNR'], 'type': 'Arrival'})
+    departures = pd.DataFrame({'time': departure_table['ETD'], 'flight': departure_table['FLIGHTNR'], 'type': 'Departure'})
+
+    # Cancelled flights do not count as movements
+    return pd.concat([arrivals[arrival_table['Status'] != 'Cancelled'], departures[departure_table['Status'] != 'Cancelled']],
+                     ignore_index=True)
+
+
+def get_flightdata(date: str, cache=None, host=DPS_HOST):  # Date in yyyy-mm-dd
+    return parse_flightdata(fetch_html(date, 'arrival', cache, host=host), fetch_html(date, 'departure', cache, host=host))
+
+
+def flight_epochs(date, flights):
+    """UTC epoch seconds of the flights of a get_flightdata table of date."""
+    return schedule_epochs(date, hhmm_to_minutes(flights['time']), SCHEDULE_TIMEZONE)
+
+
+def busiest_hour(date, times, interval, following=None, timezone=LOCAL_TIMEZONE):
+    """
+    Busiest hour starting on a schedule day, counted on UTC epoch seconds so the days the clocks
+    change have 23 or 25 hours.
+
+    :param date: str, day in 'YYYY-MM-DD' format
+    :param times: np.ndarray, UTC epoch seconds of the movements of the day, see flight_epochs
+    :param interval: int, minutes between the window starts
+    :param following: np.ndarray, epoch seconds of the movements of the next day, None wraps the
+        hours after 23:00 around to the start of this day
+    :param timezone: str, clock of the reported 'Time', e.g. 'UTC'
+    :return: dict, 'Movement_amount', 'Time' ('HH:MM' on the clock of timezone) and 'Start' (epoch seconds)
+    """
+    day_start, day_end = schedule_epochs([date, np.datetime64(date) + 1], [0, 0], SCHEDULE_TIMEZONE)
+    if following is None:
+        following = times + (day_end - day_start)
+    window_starts = np.arange(day_start, day_end, interval * 60)
+    movements = window_counts(np.concatenate((times, following)), window_starts, 3600)
+    busiest = np.argmax(movements)
+
+    return {'Movement_amount': int(movements[busiest]),
+            'Time': format_times(window_starts[busiest], timezone, '%H:%M')[0],
+            'Start': int(window_starts[busiest])
+            }
 
 
-def find_movements(date: str, interval: int):  # Date in yyyy-mm-dd, interval in minutes
-    arrival_url = "https://schiphol.dutchplanespotters.nl/?date="+date
-    arrival_table = pd.read_html(arrival_url)
-    departure_url = "https://schiphol.dutchplanespotters.nl/departures.php?date="+date
-    departure_table = pd.read_html(departure_url)
-
-    timevalues_arrival = arrival_table[0]['Arrival']['ETA']
-    flightnums_arrival = arrival_table[0]['Arrival']['FLIGHTNR']
-    status_arrival = arrival_table[0]['Arrival']['Status']
-
-    timevalues_departure = departure_table[0]['ETD']
-    flightnums_departure = departure_table[0]['FLIGHTNR']
-    status_departure = departure_table[0]['Status']
-    del arrival_table
-    del departure_table
-
-    flightdata = []
-    for i in range(len(timevalues_arrival)):
-        if status_arrival[i] != 'Cancelled':
-            flightdata.append([datetime.strptime(timevalues_arrival[i], "%H:%M").time(), flightnums_arrival[i], 'Arrival'])
-
-    for i in range(len(timevalues_departure)):
-        if status_departure[i] != 'Cancelled':
-            flightdata.append([datetime.strptime(timevalues_departure[i], "%H:%M").time(), flightnums_departure[i], 'Departure'])
-
-    # flightdata=sorted(flightdata) To improve runtime, this is smarter
-    flightdata=np.array(flightdata)
-    movement_dict = {}
-
-    for hr in range(0, 24):
-        for min in range(0, 60, interval):
-            current_time = time(hour=hr, minute=min)
-            end_time = time(hour=(hr+1) % 24, minute=min)
-            movements = len([True for tijd in flightdata[:, 0] if current_time <= tijd < end_time])
-            movement_dict[f'{hr}:{min}'] = movements
-
-    max_key = max(movement_dict, key=movement_dict.get)
-    # print(f"{movement_dict[max_key]} movements in the hour starting at {max_key}")
-    return {'Movement_amount': movement_dict[max_key],
-            'Time': datetime.strptime(max_key, "%H:%M").time().strftime("%H:%M")
-            }
+def find_movements(date: str, interval: int, next_day: bool = False, timezone=LOCAL_TIMEZONE):  # Date in yyyy-mm-dd, interval in minutes
+    times = flight_epochs(date, get_flightdata(date))
+
+    # Hours that cross midnight continue into the next day's flights, or wrap around to the start of this day
+    following = None
+    if next_day:
+        next_date = (datetime.strptime(date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        following = flight_epochs(next_date, get_flightdata(next_date))
+
+    return busiest_hour(date, times, interval, following, timezone)
     # End of definition
 
 
-start_date = datetime(2023, 1, 1)
-end_date = datetime(2023, 12, 31)
+def fetch_day(date, cache=None, session=None, host=DPS_HOST):
+    """Raw HTML of the arrival and departure pages of a date."""
+    return fetch_html(date, 'arrival', cache, session, host), fetch_html(date, 'departure', cache, session, host)
+
+
+def movements_from_html(date, arrival_html, departure_html, interval, timezone=LOCAL_TIMEZONE):
+    """Busiest hour of a day from its raw pages, like find_movements."""
+    return busiest_hour(date, flight_epochs(date, parse_flightdata(arrival_html, departure_html)), interval, timezone=timezone)
 
-# Create a list of strings for all dates in 2023
-date_strings = [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range((end_date - start_date).days + 1)]
-month_string = [(start_date + timedelta(days=10*i)).strftime('%Y-%m-%d') for i in range(36)]
 
-year_dict = {}
+def write_year_dict(output_path, year_dict):
+    """Writes the busiest hour per day in date order, to a temporary file first so a crash never leaves half a file."""
+    with open(output_path + '.tmp', 'w') as file:
+        json.dump(dict(sorted(year_dict.items())), file, indent=4)
+    os.replace(output_path + '.tmp', output_path)
 
-for day in date_strings:
-    result = find_movements(day, 1)
+
+def set_day(year_dict, day, result):
+    """Replaces the busiest hour of day in year_dict by result, whatever time its old key had."""
+    for old_key in [key for key in year_dict if key[:10] == day]:
+        del year_dict[old_key]
     year_dict[f'{day} {result["Time"]}'] = result['Movement_amount']
-    if day in month_string:
+
+
+def find_year_movements(start_date, end_date, interval=1, checkpoint_path='Checkpoints/dutch_plane_spotters.jsonl',
+                        output_path='max_movement_per_day.json', fetch_workers=4, parse_workers=None,
+                        cache_dir='Cache/dutch_plane_spotters', host=DPS_HOST, timezone=LOCAL_TIMEZONE):
+    """
+    Busiest hour of every day from start_date up to and including end_date, with the incumbent
+    maximum printed every 10 days.
+
+    The days are pipelined: a pool of fetch_workers threads downloads the pages of a day into the
+    cache directory while a pool of parse_workers processes parses the pages of earlier days and
+    finds their busiest hour. At most a few days per worker are in flight, so memory stays bounded.
+    Every finished day is checkpointed and replaces its own entry in output_path straight away. All
+    other entries of output_path are kept, so a day that fails or is not reached keeps its old
+    value. A restart skips the days that are already done with the same interval and timezone. With
+    the pages saved in cache_dir as <direction>_<date>.html the sweep runs offline, e.g. on test fixtures.
+
+    :param start_date: datetime, first day
+    :param end_date: datetime, last day
+    :param interval: int, minutes between the window starts
+    :param parse_workers: int, number of processes, None for one per CPU
+    :param timezone: str, clock of the reported hours, e.g. 'UTC'
+    :return: dict, 'YYYY-MM-DD HH:MM' schedule day and start of its busiest hour (on the clock of
+        timezone) -> movements in it, in date order, for every day in output_path
+    """
+    days = date_range(start_date, end_date)
+    parse_workers = parse_workers or os.cpu_count()
+    cache = ResponseCache(cache_dir)
+
+    year_dict = {}
+    if os.path.exists(output_path):
+        with open(output_path, 'r') as file:
+            year_dict = json.load(file)
+    # Days computed with another interval or timezone are computed again
+    key = f'{interval}:{timezone}'
+    checkpoints = {day: record for day, record in load_checkpoints(checkpoint_path).items() if record['key'] == key}
+    for day in days:
+        if day in checkpoints:
+            set_day(year_dict, day, checkpoints[day]['result'])
+    days_to_fetch = iter([day for day in days if day not in checkpoints])
+    finished = sum(day in checkpoints for day in days)
+
+    with requests.Session() as session, ThreadPoolExecutor(fetch_workers) as fetchers, ProcessPoolExecutor(parse_workers) as parsers:
+        adapter = HTTPAdapter(pool_connections=fetch_workers, pool_maxsize=fetch_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        pending = {}  # future -> (stage, day)
+
+        def fetch_next():
+            day = next(days_to_fetch, None)
+            if day is not None:
+                pending[fetchers.submit(fetch_day, day, cache, session, host)] = ('fetch', day)
+            return day is not None
+
+        # Enough days in flight to keep both pools busy
+        max_in_flight = 2 * (fetch_workers + parse_workers)
+        while len(pending) < max_in_flight and fetch_next():
+            pass
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, day = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"\nFailed to process {day}: {type(e).__name__}: {e}", file=sys.stderr)
+                    continue
+
+                if stage == 'fetch':
+                    pending[parsers.submit(movements_from_html, day, *result, interval, timezone)] = ('parse', day)
+                    continue
+
+                append_checkpoint(checkpoint_path, day, result, key)
+                set_day(year_dict, day, result)
+                write_year_dict(output_path, year_dict)
+                finished += 1
+                if finished % 10 == 0:
+                    max_day = max(year_dict, key=year_dict.get)
+                    print(f'Now at {finished} of {len(days)} days (checkpointed ones included), incumbent is '
+                          f'{year_dict[max_day]} at {max_day}')
+
+            while len(pending) < max_in_flight and fetch_next():
+                pass
+
+    year_dict = dict(sorted(year_dict.items()))
+    if year_dict:
         max_day = max(year_dict, key=year_dict.get)
-        print(f'Now at {day}, incumbent is {year_dict[max_day]} at {max_day}')
+        print(f'Maximum amount of movements was {year_dict[max_day]} and this occurred in an hour starting at {max_day}')
+    return year_dict
+
+
+def plot_year(year_dict):
+    # Imported here so the module works without a display or matplotlib
+    import matplotlib.pyplot as plt
+
+    plt.plot(list(range(len(year_dict))), [year_dict[key] for key in list(year_dict.keys())])
+    plt.show()
 
-max_day = max(year_dict, key=year_dict.get)
-print(f'Maximum amount of movements was {year_dict[max_day]} and this occurred in an hour starting at {max_day}')
 
-plt.plot(list(range(len(year_dict))),[year_dict[key] for key in list(year_dict.keys())])
-plt.show()
+if __name__ == '__main__':
+    plot_year(find_year_movements(datetime(2023, 1, 1), datetime(2023, 12, 31)))
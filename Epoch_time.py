@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Time handling of the movement counters
+
+Internally every time is an int64 count of UTC epoch seconds, which sorts, subtracts and bins
+without any timezone. Local (Europe/Amsterdam) wall-clock time is only computed at the edge, when
+a result is reported or grouped per local day, with the UTC offsets of zoneinfo looked up once per
+quarter hour that occurs instead of once per time.
+"""
+
+from datetime import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+LOCAL_TIMEZONE = 'Europe/Amsterdam'
+SECONDS_PER_DAY = 86400
+# Offsets only change on whole quarter hours in every zone of the tz database
+OFFSET_RESOLUTION = 900
+
+
+def utc_offsets(epochs, timezone=LOCAL_TIMEZONE):
+    """
+    UTC offset in seconds at every time, e.g. 3600 or 7200 for Europe/Amsterdam.
+
+    :param epochs: array-like of int, UTC epoch seconds
+    :param timezone: str, IANA timezone name
+    :return: np.ndarray of int64, same shape as epochs
+    """
+    epochs = np.asarray(epochs, dtype=np.int64)
+    if timezone == 'UTC':
+        return np.zeros(epochs.shape, dtype=np.int64)
+
+    zone = ZoneInfo(timezone)
+    quarters, inverse = np.unique(epochs // OFFSET_RESOLUTION, return_inverse=True)
+    offsets = np.array([datetime.fromtimestamp(int(quarter) * OFFSET_RESOLUTION, zone).utcoffset().total_seconds()
+                        for quarter in quarters], dtype=np.int64)
+    return offsets[inverse].reshape(epochs.shape)
+
+
+def local_seconds(epochs, timezone=LOCAL_TIMEZONE):
+    """Wall-clock time in the timezone as seconds since 1970-01-01 00:00 on that clock."""
+    epochs = np.asarray(epochs, dtype=np.int64)
+    return epochs + utc_offsets(epochs, timezone)
+
+
+def local_to_epochs(local, timezone=LOCAL_TIMEZONE):
+    """
+    UTC epoch seconds of wall-clock times, the inverse of local_seconds.
+
+    A time that occurs twice when the clocks go back is taken as the first (summer time), a time
+    that is skipped when the clocks go forward gets the offset from before the change.
+
+    :param local: array-like of int, seconds since 1970-01-01 00:00 on the clock of the timezone
+    :return: np.ndarray of int64, same shape as local
+    """
+    local = np.asarray(local, dtype=np.int64)
+    # The offsets a day earlier and a day later are the ones on both sides of any change near the time
+    earlier = local - utc_offsets(local - SECONDS_PER_DAY, timezone)
+    later = local - utc_offsets(local + SECONDS_PER_DAY, timezone)
+    earlier_valid = local_seconds(earlier, timezone) == local
+    later_valid = local_seconds(later, timezone) == local
+    return np.where(earlier_valid & later_valid, np.minimum(earlier, later), np.where(later_valid, later, earlier))
+
+
+def schedule_epochs(dates, minutes, timezone=LOCAL_TIMEZONE):
+    """
+    UTC epoch seconds of schedule times given as a local date and minute of the day.
+
+    :param dates: date, 'YYYY-MM-DD' or array-like of them, one for all minutes or one per minute
+    :param minutes: array-like of int, minutes since local midnight, e.g. from hhmm_to_minutes
+    :return: np.ndarray of int64
+    """
+    days = np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+    return local_to_epochs(days * SECONDS_PER_DAY + np.asarray(minutes, dtype=np.int64) * 60, timezone)
+
+
+def local_days(epochs, timezone=LOCAL_TIMEZONE):
+    """Day in the timezone of every time, as days since 1970-01-01."""
+    return local_seconds(epochs, timezone) // SECONDS_PER_DAY
+
+
+def day_keys(epochs, timezone=LOCAL_TIMEZONE, date_format='%Y.%m.%d'):
+    """
+    Date string of every time in the timezone, e.g. '2023.08.01' like the ADS-B data directories.
+
+    :return: np.ndarray of str, same shape as epochs
+    """
+    days, inverse = np.unique(local_days(epochs, timezone), return_inverse=True)
+    keys = np.array([day.item().strftime(date_format) for day in days.astype('datetime64[D]')], dtype=str)
+    return keys[inverse].reshape(np.shape(epochs))
+
+
+def day_of(timezone=LOCAL_TIMEZONE, date_format='%Y.%m.%d'):
+    """
+    Function of a single time to its date string like day_keys, for loops over one time at a time.
+
+    Local midnight falls on a quarter hour, so the date is looked up once per quarter hour.
+    """
+    @lru_cache(maxsize=None)
+    def quarter_day(quarter):
+        return str(day_keys(quarter * OFFSET_RESOLUTION, timezone, date_format))
+
+    return lambda epoch: quarter_day(int(epoch) // OFFSET_RESOLUTION)
+
+
+def to_datetime(epoch, timezone=LOCAL_TIMEZONE):
+    """A single time as a timezone aware datetime, for reporting."""
+    return datetime.fromtimestamp(int(epoch), ZoneInfo(timezone))
+
+
+def format_times(epochs, timezone=LOCAL_TIMEZONE, time_format='%Y-%m-%d %H:%M:%S'):
+    """
+    Times as strings on the clock of the timezone.
+
+    :return: list of str
+    """
+    wall_clock = local_seconds(epochs, timezone).astype('datetime64[s]')
+    return [time.item().strftime(time_format) for time in np.atleast_1d(wall_clock)]
@@ -11,21 +11,34 @@ import numpy as np
 import pandas as pd
 import requests
 import datetime
+from io import StringIO
 from fake_http_header import FakeHttpHeader
 
+from Airports import AIRPORTS
+from Async_fetcher import ResponseCache, fetch_all
+from Epoch_time import LOCAL_TIMEZONE, format_times, schedule_epochs
+from Sliding_window import hhmm_to_minutes, window_counts
+
+FLIGHTERA_HOST = "https://www.flightera.net"
+
+# Responses are cached per (airport, type, date, hour), a rerun never hits flightera.net again
+response_cache = ResponseCache('Cache/flightera')
+
 # %% Request html
 
 
-def generate_url(date, time, type='departure'):
+def generate_url(date, time, type='departure', host=FLIGHTERA_HOST, airport='EHAM'):
     """
     Generates a URL for a specific date and time for either departure or arrival data.
 
     :param date: datetime.date, the date for which to generate the URL
     :param time: str, the time in 'HH:MM' format
     :param type: str, type of data to retrieve ('departure' or 'arrival')
+    :param host: str, scheme and host of the site, e.g. a local stub server for testing
+    :param airport: str, ICAO code of an airport in Airports.AIRPORTS
     :return: str, URL
     """
-    base_url = f"https://www.flightera.net/en/airport/Amsterdam/EHAM/{type}/"
+    base_url = f"{host}/en/airport/{AIRPORTS[airport].city}/{airport}/{type}/"
     # Format date as 'YYYY-MM-DD' and time as 'HH_MM'
     formatted_date = date.strftime('%Y-%m-%d')
     formatted_time = time.replace(':', '_')
@@ -33,7 +46,7 @@ def generate_url(date, time, type='departure'):
     return url
 
 
-def get_html_data(date, time, type):
+def get_html_data(date, time, type, host=FLIGHTERA_HOST):
     """
     Retrieves HTML data from a URL for a specific date and time.
 
@@ -42,10 +55,10 @@ def get_html_data(date, time, type):
     :return: requests.Response, raw HTML data from the request
     """
 
-    departure_url = generate_url(date, time, type)
+    departure_url = generate_url(date, time, type, host)
 
     # fake random header generator to not get blacklisted
-    fake_header = FakeHttpHeader(domain_name='nl').as_header_dict()
+    fake_header = FakeHttpHeader(domain_code='nl').as_header_dict()
 
     # old header which got me blacklisted
     headers = {
@@ -65,6 +78,30 @@ def get_html_data(date, time, type):
     raw_html = requests.get(departure_url, headers=fake_header)
     return raw_html
 
+
+def random_header():
+    """Fake random header for every request to not get blacklisted."""
+    return FakeHttpHeader(domain_code='nl').as_header_dict()
+
+
+def get_html_pages(date, times, types, host=FLIGHTERA_HOST, concurrency=4, rate=1.0, retries=3, airport='EHAM'):
+    """
+    Retrieves the HTML pages of all combinations of times and types concurrently.
+
+    Pages come from the response cache when possible, the others are fetched with a shared
+    connection pool, at most concurrency at a time and rate requests per second on average.
+
+    :param date: datetime.date, the date for which to retrieve data
+    :param times: list of str, times in 'HH:MM' format
+    :param types: list of str, types of data to retrieve ('departure' and/or 'arrival')
+    :param airport: str, ICAO code of an airport in Airports.AIRPORTS
+    :return: dict, (type, time) -> page with the raw HTML as .text, like get_html_data
+    """
+    page_requests = [((airport, type, date.strftime('%Y-%m-%d'), time), generate_url(date, time, type, host, airport))
+                     for type in types for time in times]
+    pages = fetch_all(page_requests, cache=response_cache, concurrency=concurrency, rate=rate, retries=retries, headers=random_header)
+    return {(type, time): pages[(airport, type, date.strftime('%Y-%m-%d'), time)] for type in types for time in times}
+
 # %% prepare data
 
 
@@ -80,7 +117,7 @@ def process_html_data(raw_html, type):
     :return: pd.DataFrame, cleaned DataFrame with columns ['date', 'flight', 'time']
     """
     # Extract the first table from the HTML response
-    departure_table = pd.read_html(raw_html.text)[0]
+    departure_table = pd.read_html(StringIO(raw_html.text))[0]
 
     # To grab correct column
     if type == 'arrival':
@@ -131,13 +168,14 @@ def append_to_dataframe(existing_df, new_data):
 
 # %% function to get info of specified period in day
 
-def retrieve_data(date, start_time, end_time):
+def retrieve_data(date, start_time, end_time, **fetch_options):
     """
     Retrieves and processes both departure and arrival data for a specified day and time window.
 
     :param date: datetime.date, the date for which to retrieve data
     :param start_time: str, the start time in 'HH:MM' format for the time window
     :param end_time: str, the end time in 'HH:MM' format for the time window
+    :param fetch_options: host, concurrency, rate, retries and airport, passed on to get_html_pages
     :return: tuple of pd.DataFrame, (departure data, arrival data)
     """
     start_datetime = datetime.datetime.combine(date, datetime.datetime.strptime(start_time, '%H:%M').time())
@@ -146,82 +184,76 @@ def retrieve_data(date, start_time, end_time):
     departure_data = None
     arrival_data = None
 
-    # Retrieve Departure Data
+    # Every hour in the window, fetched concurrently for both types
+    times = []
     current_time = start_datetime
     while current_time <= end_datetime:
-        formatted_time = current_time.strftime('%H:%M')
-        html_data = get_html_data(date, formatted_time, type='departure')
-        processed_data = process_html_data(html_data, type='departure')
-        departure_data = append_to_dataframe(departure_data, processed_data)
+        times.append(current_time.strftime('%H:%M'))
         current_time += datetime.timedelta(hours=1)
+    pages = get_html_pages(date, times, ['departure', 'arrival'], **fetch_options)
+
+    # Retrieve Departure Data
+    for formatted_time in times:
+        processed_data = process_html_data(pages[('departure', formatted_time)], type='departure')
+        departure_data = append_to_dataframe(departure_data, processed_data)
 
     # Retrieve Arrival Data
-    current_time = start_datetime
-    while current_time <= end_datetime:
-        formatted_time = current_time.strftime('%H:%M')
-        html_data = get_html_data(date, formatted_time, type='arrival')
-        processed_data = process_html_data(html_data, type='arrival')
+    for formatted_time in times:
+        processed_data = process_html_data(pages[('arrival', formatted_time)], type='arrival')
         arrival_data = append_to_dataframe(arrival_data, processed_data)
-        current_time += datetime.timedelta(hours=1)
 
     return departure_data, arrival_data
 
 
-specific_date = datetime.date(2023, 8, 10)
-start_time = "08:00"
-end_time = "12:00"
-departure_data, arrival_data = retrieve_data(specific_date, start_time, end_time)
-
-
 # %% Find maximunm movements
 
 
-def find_max_movements(start_date, end_date, start_hour, end_hour, interval):
+def find_max_movements(start_date, end_date, start_hour, end_hour, interval, timezone=LOCAL_TIMEZONE, **fetch_options):
     """
     Analyzes flight movements data over a range of dates and within a specified hour window each day.
     Finds the maximum number of arrivals and departures within a given interval.
     Prints the maximum movements per day and the overall maximum.
 
+    The flight times are local times of the airport, they are counted as UTC epoch seconds and the
+    window starts are reported on the clock of timezone.
+
     :param start_date: datetime.date, the start date of the period
     :param end_date: datetime.date, the end date of the period
     :param start_hour: int, the start hour of the analysis window
     :param end_hour: int, the end hour of the analysis window
     :param interval: int, interval in minutes
+    :param timezone: str, clock of the reported times, e.g. 'UTC'
+    :param fetch_options: host, concurrency, rate, retries and airport, passed on to get_html_pages
     :return: dict, information about the day and time with the highest movement count
     """
     max_movements = 0
     max_movement_time = None
     max_movement_day = None
+    schedule_timezone = AIRPORTS[fetch_options.get('airport', 'EHAM')].timezone
 
     for single_date in pd.date_range(start=start_date, end=end_date, freq='D'):
         daily_max_movements = 0
         daily_max_time = None
 
         # Retrieve data for the day
-        arrival_data, departure_data = retrieve_data(single_date.date(), f'{start_hour:02d}:00', f'{end_hour:02d}:00')
-
-        for hr in range(start_hour, end_hour):
-            for min in range(0, 60, interval):
-                current_time = datetime.time(hour=hr, minute=min)
-                end_time = (datetime.datetime.combine(datetime.date.today(), current_time) + datetime.timedelta(minutes=interval)).time()
+        arrival_data, departure_data = retrieve_data(single_date.date(), f'{start_hour:02d}:00', f'{end_hour:02d}:00', **fetch_options)
 
-                movements = 0
-                for index, row in arrival_data.iterrows():
+        # Parse the times once into epoch seconds, every window is counted with a searchsorted sweep
+        times = np.concatenate([schedule_epochs(data['date'].to_numpy(), hhmm_to_minutes(data['time']), schedule_timezone)
+                                for data in (arrival_data, departure_data)])
+        window_minutes = np.add.outer(np.arange(start_hour, end_hour) * 60, np.arange(0, 60, interval)).ravel()
+        window_starts = schedule_epochs(single_date.date(), window_minutes, schedule_timezone)
+        counts = window_counts(times, window_starts, interval * 60)
 
-                    if current_time <= datetime.datetime.strptime(row['time'], "%H:%M").time() < end_time:
-                        movements += 1
-                for index, row in departure_data.iterrows():
-                    if current_time <= datetime.datetime.strptime(row['time'], "%H:%M").time() < end_time:
-                        movements += 1
+        if counts.size and counts.max() > 0:
+            busiest = np.argmax(counts)
+            daily_max_movements = int(counts[busiest])
+            daily_max_time = format_times(window_starts[busiest], timezone, '%H:%M')[0]
 
-                if movements > daily_max_movements:
-                    daily_max_movements = movements
-                    daily_max_time = f'{hr:02d}:{min:02d}'
-
-                if movements > max_movements:
-                    max_movements = movements
-                    max_movement_time = f'{hr:02d}:{min:02d}'
-                    max_movement_day = single_date.strftime('%Y-%m-%d')
+        if daily_max_movements > max_movements:
+            max_movements = daily_max_movements
+            max_movement_time = daily_max_time
+            max_movement_day = single_date.strftime('%Y-%m-%d')
 
         print(f"Max movements on {single_date.strftime('%Y-%m-%d')}: {daily_max_movements} at {daily_max_time}")
 
@@ -229,9 +261,17 @@ def find_max_movements(start_date, end_date, start_hour, end_hour, interval):
     return {'Day': max_movement_day, 'Time': max_movement_time, 'Movement_amount': max_movements}
 
 
-start_date = datetime.date(2023, 8, 9)
-end_date = datetime.date(2023, 8, 11)
-start_hour = 4
-end_hour = 12
-interval = 1  # minute
-result = find_max_movements(start_date, end_date, start_hour, end_hour, interval)
+# %% Main
+
+if __name__ == '__main__':
+    specific_date = datetime.date(2023, 8, 10)
+    start_time = "08:00"
+    end_time = "12:00"
+    departure_data, arrival_data = retrieve_data(specific_date, start_time, end_time)
+
+    start_date = datetime.date(2023, 8, 9)
+    end_date = datetime.date(2023, 8, 11)
+    start_hour = 4
+    end_hour = 12
+    interval = 1  # minute
+    result = find_max_movements(start_date, end_date, start_hour, end_hour, interval)
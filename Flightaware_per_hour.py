@@ -8,45 +8,76 @@ Created on Sun Jan 28 15:55:41 2024
 @author: Max & Jens
 """
 
-import numpy as np
-import pandas as pd
 import json
-from datetime import datetime
-import requests
+
+import pandas as pd
 
 # %%
 
-# Read the JSON data from the file
-with open('flightaware_data.json', 'r') as file:  # Data from https://www.flightaware.com/ajax/ignoreuser/airport_stats.rvt?airport=EHAM
-    data = json.load(file)
 
-# Process the data
-# Create a list of tuples in the form (date, total_flights)
-flights_data = [
-    (
-        datetime.utcfromtimestamp(day['date']).strftime('%Y-%m-%d'),
-        day['arrivals'] + day['departures'],
-        day['arrivals'],
-        day['departures']
-    )
-    for day in data['chart_data']
-    if datetime.utcfromtimestamp(day['date']).year == 2023
-]
+def load_flightaware(file_path='flightaware_data.json'):
+    """
+    Reads the FlightAware daily airport stats into a DataFrame.
+
+    :param file_path: str, JSON from https://www.flightaware.com/ajax/ignoreuser/airport_stats.rvt?airport=EHAM
+    :return: pd.DataFrame, indexed by the (UTC) date as datetime64 in ascending order, with the columns
+        arrivals, departures and total
+    """
+    with open(file_path, 'r') as file:
+        data = json.load(file)
+
+    stats = pd.DataFrame(data['chart_data'], columns=['date', 'arrivals', 'departures'])
+    stats['date'] = pd.to_datetime(stats['date'], unit='s')
+    stats['total'] = stats['arrivals'] + stats['departures']
+    return stats.set_index('date').sort_index()
+
 
+def top_days(stats, k=5, by='total', start=None, end=None):
+    """
+    The k busiest days between start and end (both included), the earliest day first on ties.
 
-# Sort the list by total_flights in descending order to find the busiest days
-sorted_flights_data = sorted(flights_data, key=lambda x: x[1], reverse=True)
+    :param stats: pd.DataFrame, result of load_flightaware
+    :param k: int, number of days
+    :param by: str, 'total', 'arrivals' or 'departures'
+    :param start: str or datetime, first day, None for the first day in the data
+    :param end: str or datetime, last day, None for the last day in the data
+    :return: pd.DataFrame, the rows of the k days from busiest to least busy
+    """
+    return stats.loc[start:end].sort_values(by, ascending=False, kind='stable').head(k)
 
-sorted_flights_data[:5]  # Display the top 5 busiest days
 
+def rollup(stats, period='week', start=None, end=None):
+    """
+    Movements added up per week (starting on Monday) or per calendar month.
+
+    :param stats: pd.DataFrame, result of load_flightaware
+    :param period: str, 'week' or 'month'
+    :return: pd.DataFrame, indexed by the first day of every period, with the summed columns and the
+        number of days with data in the period
+    """
+    # Weekly bins are [Monday, next Monday), labelled with their Monday
+    frequency = {'week': 'W-MON', 'month': 'MS'}[period]
+    grouped = stats.loc[start:end].resample(frequency, closed='left', label='left')
+    totals = grouped[['arrivals', 'departures', 'total']].sum()
+    totals['days'] = grouped['total'].count()
+    return totals
+
+
+# %%
+
+if __name__ == '__main__':
+    stats = load_flightaware()
 
-# Display the busiest day with total flights, arrivals, and departures separately
-busiest_day = sorted_flights_data[0] if sorted_flights_data else None
-busiest_day_info = {
-    'date': busiest_day[0],
-    'total_flights': busiest_day[1],
-    'arrivals': busiest_day[2],
-    'departures': busiest_day[3]
-}
+    # The busiest days of 2023
+    busiest_days = top_days(stats, 5, start='2023-01-01', end='2023-12-31')
+    print(busiest_days)
 
-busiest_day_info
+    # Display the busiest day with total flights, arrivals, and departures separately
+    busiest_day = busiest_days.iloc[0]
+    busiest_day_info = {
+        'date': busiest_days.index[0].strftime('%Y-%m-%d'),
+        'total_flights': int(busiest_day['total']),
+        'arrivals': int(busiest_day['arrivals']),
+        'departures': int(busiest_day['departures'])
+    }
+    print(busiest_day_info)
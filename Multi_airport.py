@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Analyses several airports in one pass over the raw trace files
+
+Every file is decompressed and decoded once, its points are tested against the boxes of all
+airports in one broadcast comparison and routed to every airport they are in. The movement
+detection then runs per airport, so N airports cost one scan of the day instead of N.
+"""
+
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+import glob
+from functools import partial
+import os
+from operator import itemgetter
+import sys
+
+import numpy as np
+
+from ADSB_events import ARRIVED
+from ADSB_lol_data_parser import analyze_altitude_changes, day_file_pattern, load_trace_json, print_progress
+from Airports import AIRPORTS, airport_boxes
+from Epoch_time import format_times
+from Pipeline_metrics import Metrics, active_metrics
+from Sliding_window import busiest_windows
+from Trace_index import build_index, query_index
+
+
+def route_trace(trace, boxes):
+    """
+    Indices of the points of a trace inside every box.
+
+    :param trace: list of points, [timestamp, lat, lon, ...]
+    :param boxes: tuple of np.ndarray, (top, left, bottom, right) per airport, see airport_boxes
+    :return: dict, airport position in boxes -> np.ndarray of point indices, only airports with points
+    """
+    if not trace:
+        return {}
+    top, left, bottom, right = boxes
+    lat = np.fromiter(map(itemgetter(1), trace), dtype=np.float64, count=len(trace))
+    lon = np.fromiter(map(itemgetter(2), trace), dtype=np.float64, count=len(trace))
+
+    # Skip the per point work if the extent of the trace cannot intersect any box
+    near = (lat.min() <= top) & (lat.max() >= bottom) & (lon.max() >= left) & (lon.min() <= right)
+    if not near.any():
+        return {}
+
+    candidates = np.flatnonzero(near)
+    inside = ((lat[:, None] <= top[candidates]) & (lat[:, None] >= bottom[candidates])
+              & (lon[:, None] >= left[candidates]) & (lon[:, None] <= right[candidates]))
+    return {int(airport): np.flatnonzero(inside[:, column]) for column, airport in enumerate(candidates) if inside[:, column].any()}
+
+
+def route_files(file_paths, airports):
+    """
+    Filter a chunk of files for all airports at once.
+
+    :return: tuple, (dict airport icao -> filtered traces in file order, Metrics of the chunk with
+        the number of failed files per exception type in its errors, like filter_files)
+    """
+    boxes = airport_boxes(airports)
+    routed = defaultdict(list)
+    metrics = Metrics()
+
+    for file_path in file_paths:
+        metrics.count('files')
+        try:
+            data = load_trace_json(file_path, metrics)
+            trace = data['trace']
+            with metrics.timer('route'):
+                file_routed = {airports[airport].icao: {'icao': data['icao'], 'registration': data.get('r', None),
+                                                        'timestamp': data.get('timestamp', 0), 'trace': [trace[i] for i in indices]}
+                               for airport, indices in route_trace(trace, boxes).items()}
+        except Exception as e:
+            print(f"\nAn error occurred with file {file_path}: {e}", file=sys.stderr)
+            metrics.errors[type(e).__name__] += 1
+            continue
+
+        # Only a file that was read completely adds traces
+        for icao, filtered_trace in file_routed.items():
+            routed[icao].append(filtered_trace)
+            metrics.count(f'points kept {icao}', len(filtered_trace['trace']))
+
+    return dict(routed), metrics
+
+
+def filter_all_airports(file_pattern, airports=tuple(AIRPORTS.values()), workers=1, chunk_size=250, index_path=None):
+    """
+    Filter all trace files matching the pattern for points near any of the airports, in one pass.
+
+    Works like filter_all_data: with workers > 1 the chunks are filtered by a process pool and merged
+    in file order, with index_path only the files passing through one of the boxes are opened.
+
+    :param airports: sequence of Airport, e.g. [AIRPORTS['EHAM'], AIRPORTS['EHRD']]
+    :return: dict, airport icao -> filtered traces, every airport is in it
+    """
+    airports = tuple(airports)
+    if index_path is None:
+        files = sorted(glob.glob(file_pattern, recursive=True))
+    else:
+        index = build_index(file_pattern, index_path, workers, chunk_size)
+        candidates = set()
+        for airport in airports:
+            candidates.update(query_index(index, *airport.bbox))
+        files = sorted(candidates)
+    chunks = [files[i:i + chunk_size] for i in range(0, len(files), chunk_size)]
+
+    filtered_traces = {airport.icao: [] for airport in airports}
+    metrics = Metrics()
+    files_done = 0
+
+    def merge(chunk, chunk_routed, chunk_metrics):
+        nonlocal files_done
+        for icao, traces in chunk_routed.items():
+            filtered_traces[icao].extend(traces)
+        metrics.merge(chunk_metrics)
+        files_done += len(chunk)
+        print_progress(files_done, len(files))
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk, (chunk_routed, chunk_metrics) in zip(chunks, executor.map(partial(route_files, airports=airports), chunks)):
+                merge(chunk, chunk_routed, chunk_metrics)
+    else:
+        for chunk in chunks:
+            merge(chunk, *route_files(chunk, airports))
+
+    active_metrics().merge(metrics)
+    print(f"\nFiltered {', '.join(f'{len(traces)} planes near {icao}' for icao, traces in filtered_traces.items())}.")
+    if metrics.errors:
+        print(f"Skipped {sum(metrics.errors.values())} files with errors: {dict(metrics.errors)}", file=sys.stderr)
+
+    return filtered_traces
+
+
+def analyze_airports(date, airports=tuple(AIRPORTS.values()), workers=1, data_dir='Data', use_geofence=False,
+                     window=timedelta(hours=1), use_index=False, cache_dir='Cache'):
+    """
+    Movements and busiest hour of every airport on one day, from a single pass over the raw files.
+
+    :param use_geofence: bool, only count transitions on the runway zones of the airport
+    :param use_index: bool, only open the files the sidecar index <cache_dir>/<date>.index.npz
+        selects, the same index load_or_filter_day uses
+    :return: dict, airport icao -> {'total movements', 'busiest hour' (local time of the airport),
+        'busiest hour start' (UTC epoch seconds), 'busiest hour movements', 'arrivals', 'departures'}
+    """
+    airports = tuple(airports)
+    index_path = os.path.join(cache_dir, f'{date}.index.npz') if use_index else None
+    filtered_traces = filter_all_airports(day_file_pattern(date, data_dir), airports, workers, index_path=index_path)
+    results = {}
+
+    for airport in airports:
+        events = analyze_altitude_changes(filtered_traces[airport.icao], geofence=airport.geofence if use_geofence else None)
+        arrivals, departures = events.counts()
+        busiest = busiest_windows(events.timestamp, events.event == ARRIVED, window.total_seconds())
+        results[airport.icao] = {'total movements': arrivals + departures, 'arrivals': arrivals, 'departures': departures,
+                                 'busiest hour': None, 'busiest hour start': None, 'busiest hour movements': 0}
+        if busiest:
+            start, _, _, total = busiest[0]
+            results[airport.icao]['busiest hour'] = format_times(start, airport.timezone)[0]
+            results[airport.icao]['busiest hour start'] = int(start)
+            results[airport.icao]['busiest hour movements'] = total
+        print(f"{airport.icao}: {results[airport.icao]}")
+
+    return results
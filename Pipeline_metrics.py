@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Timers and counters for the stages of the ADS-B pipeline
+
+A run (e.g. one day) is wrapped in record(), the instrumented stages add their time and counts to
+the metrics of that run. Without an active record() the measurements are thrown away.
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+import cProfile
+from functools import wraps
+import json
+import os
+import time
+import tracemalloc
+
+_active = None
+
+
+class Metrics:
+    """
+    Seconds spent per timer, counters and the number of failed files per exception type. run holds
+    the facts of the whole run filled in by record(), like its label and wall time.
+
+    Metrics are plain data so worker processes can return theirs to be merged. Timers of workers
+    add up, so with several workers a stage can take longer in total than the wall time of the run.
+    """
+
+    def __init__(self):
+        self.timers = Counter()
+        self.counters = Counter()
+        self.errors = Counter()
+        self.run = {}
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] += time.perf_counter() - start
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def merge(self, other):
+        self.timers.update(other.timers)
+        self.counters.update(other.counters)
+        self.errors.update(other.errors)
+
+    def summary(self):
+        """The metrics as a JSON serialisable dict."""
+        return dict(self.run, timers=dict(self.timers), counters=dict(self.counters), errors=dict(self.errors))
+
+
+def active_metrics():
+    """Metrics of the run in progress, or a throwaway Metrics if nothing is recorded."""
+    return _active if _active is not None else Metrics()
+
+
+def instrumented(name, counters=None):
+    """
+    Decorator that adds the time of every call to the timer name of the active metrics.
+
+    :param name: str, name of the timer, the number of calls is counted as '<name> calls'
+    :param counters: function returning a dict of counters to add for the result of a call, or None
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            metrics = active_metrics()
+            with metrics.timer(name):
+                result = function(*args, **kwargs)
+            metrics.count(f'{name} calls')
+            if counters is not None:
+                metrics.counters.update(counters(result))
+            return result
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def record(label, summary_dir=None, profile=False, trace_memory=False):
+    """
+    Collects the metrics of everything run inside the with block.
+
+    With summary_dir the summary is written to <summary_dir>/<label>.json when the block ends, also
+    when it fails. profile runs cProfile and writes its stats to <label>.prof next to it (open with
+    pstats or snakeviz), trace_memory adds the peak memory traced by tracemalloc. Both only see this
+    process, not the workers of a process pool, and slow the run down.
+
+    :param label: str, name of the run, e.g. the day
+    :return: Metrics, filled while the block runs
+    """
+    global _active
+    outer, _active = _active, Metrics()
+    metrics = _active
+    profiler = cProfile.Profile() if profile else None
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    start = time.perf_counter()
+
+    try:
+        yield metrics
+    finally:
+        wall_time = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+        _active = outer
+
+        metrics.run.update(label=label, wall_time=wall_time)
+        if trace_memory:
+            metrics.run['peak_traced_memory'] = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+
+        if summary_dir is not None:
+            os.makedirs(summary_dir, exist_ok=True)
+            if profiler is not None:
+                metrics.run['profile'] = os.path.join(summary_dir, f'{label}.prof')
+                profiler.dump_stats(metrics.run['profile'])
+            with open(os.path.join(summary_dir, f'{label}.json'), 'w', encoding='utf-8') as file:
+                json.dump(metrics.summary(), file, indent=4)
+        if outer is not None:
+            outer.merge(metrics)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Reconciles the ADS-B movements with the scheduled flights of Flightera and Dutch Plane Spotters
+
+Both sides are turned into tables of (UTC epoch time, event code, flight key) and joined with
+pd.merge_asof on the flight and the nearest time within a tolerance, instead of comparing every
+movement with every flight. Every movement ends up as matched, ADS-B only or schedule only, and
+the three are counted per rolling hour.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from ADSB_events import ARRIVED, DEPARTED
+from Epoch_time import LOCAL_TIMEZONE, schedule_epochs
+from Sliding_window import hhmm_to_minutes, window_sums
+
+# ICAO airline designators (used in callsigns) of the common Schiphol airlines and their IATA code
+# (used in flight numbers). Airlines that are not listed only match when both sides use the same code
+AIRLINE_CODES = {
+    'KLM': 'KL', 'TRA': 'HV', 'EZY': 'U2', 'BAW': 'BA', 'DLH': 'LH', 'AFR': 'AF', 'SAS': 'SK', 'IBE': 'IB',
+    'VLG': 'VY', 'RYR': 'FR', 'DAL': 'DL', 'UAL': 'UA', 'AAL': 'AA', 'TAP': 'TP', 'SWR': 'LX', 'AUA': 'OS',
+    'BEL': 'SN', 'FIN': 'AY', 'THY': 'TK', 'EIN': 'EI', 'ICE': 'FI', 'NAX': 'DY', 'NOZ': 'DY', 'LOT': 'LO',
+}
+SCHEDULE_TIMEZONE = LOCAL_TIMEZONE
+EVENT_CODES = {'arrival': ARRIVED, 'Arrival': ARRIVED, 'departure': DEPARTED, 'Departure': DEPARTED}
+
+
+def flight_key(flights):
+    """
+    Normalises flight numbers and callsigns to IATA code + number without leading zeros, e.g. 'KLM0123'
+    and 'KL 123' both become 'KL123'. Values that do not look like a flight number become ''.
+    """
+    parts = pd.Series(flights, dtype=str).str.upper().str.replace(' ', '', regex=False).str.extract(r'^([A-Z]{3}|[A-Z0-9]{2})0*(\d[0-9A-Z]*)$')
+    airline = parts[0].map(lambda code: AIRLINE_CODES.get(code, code), na_action='ignore')
+    return (airline + parts[1]).fillna('').to_numpy(dtype=str)
+
+
+def adsb_table(events):
+    """The events of an EventTable as a table with time (epoch seconds), event code, flight key, icao and registration."""
+    return pd.DataFrame({'time': events.timestamp,
+                         'event': events.event,
+                         'flight': flight_key(events.callsign),
+                         'icao': events.icao[events.aircraft],
+                         'registration': events.registration[events.aircraft]})
+
+
+def schedule_table(flights, date=None, type=None, timezone=SCHEDULE_TIMEZONE):
+    """
+    A schedule table as a table with time (UTC epoch seconds), event code and flight key.
+
+    Accepts the Flightera tables of process_html_data (date column, one table per type) and the
+    Dutch Plane Spotters table of get_flightdata (type column, one table per date). Times are local
+    'HH:MM' times converted by schedule_epochs, like the busiest hours of the scrapers.
+
+    :param flights: pd.DataFrame with the columns time, flight and date and/or type
+    :param date: str or datetime.date, date of all flights if the table has no date column
+    :param type: str, 'arrival' or 'departure' for all flights if the table has no type column
+    """
+    dates = flights['date'].astype(str).to_numpy() if 'date' in flights else str(date)
+    times = schedule_epochs(dates, hhmm_to_minutes(flights['time'].astype(str)), timezone)
+
+    return pd.DataFrame({'time': times,
+                         'event': flights['type'].map(EVENT_CODES) if 'type' in flights else EVENT_CODES[type],
+                         'flight': flight_key(flights['flight'])}, index=flights.index).astype({'time': np.int64, 'event': np.uint8})
+
+
+def reconcile(adsb, schedule, tolerance=timedelta(minutes=30)):
+    """
+    Matches every ADS-B movement to the scheduled flight with the same flight key and event code
+    that is nearest in time, within tolerance. A scheduled flight is matched at most once, the
+    ADS-B movement nearest to it wins and the others stay unmatched.
+
+    Schedule times are gate times and the ADS-B times runway times, so the tolerance has to cover
+    taxiing and delays.
+
+    :param adsb: pd.DataFrame, result of adsb_table
+    :param schedule: pd.DataFrame, result of schedule_table (several can be concatenated)
+    :param tolerance: timedelta, largest difference between the ADS-B time and the scheduled time
+    :return: tuple of pd.DataFrame, (matched, ADS-B only, schedule only); matched has the ADS-B
+        columns plus schedule_time
+    """
+    left = adsb.reset_index(drop=True).rename_axis('adsb_row').reset_index().sort_values('time', kind='stable')
+    right = schedule.reset_index(drop=True).rename_axis('schedule_row').reset_index().sort_values('time', kind='stable')
+    right = right[right['flight'] != ''].assign(schedule_time=lambda table: table['time'])
+
+    joined = pd.merge_asof(left, right[['time', 'event', 'flight', 'schedule_row', 'schedule_time']], on='time',
+                           by=['event', 'flight'], tolerance=int(tolerance.total_seconds()), direction='nearest')
+    candidates = joined.dropna(subset=['schedule_row'])
+
+    # One ADS-B movement per scheduled flight, the nearest in time
+    candidates = candidates.assign(difference=(candidates['time'] - candidates['schedule_time']).abs())
+    matched = candidates.sort_values(['difference', 'time'], kind='stable').drop_duplicates('schedule_row')
+    matched = matched.sort_values('time', kind='stable')
+
+    adsb_only = left[~left['adsb_row'].isin(matched['adsb_row'])]
+    schedule_only = right[~right['schedule_row'].isin(matched['schedule_row'])]
+    schedule_only = pd.concat([schedule_only, schedule[schedule['flight'] == ''].reset_index(drop=True)], ignore_index=True)
+
+    return (matched.drop(columns=['adsb_row', 'schedule_row', 'difference']).astype({'schedule_time': np.int64}),
+            adsb_only.drop(columns='adsb_row'), schedule_only.drop(columns=['schedule_row', 'schedule_time']))
+
+
+def rolling_counts(matched, adsb_only, schedule_only, window=timedelta(hours=1), step=timedelta(minutes=1), timezone=LOCAL_TIMEZONE):
+    """
+    Number of matched, ADS-B only and schedule only movements in the window starting at every step.
+
+    All movements are binned per step on one epoch time axis (matched ones at their ADS-B time), the
+    window counts follow from window_sums. Runs across midnight and over any number of days. The
+    window starts are only converted to timezone for the index.
+
+    :return: pd.DataFrame, indexed by the window start in timezone, columns matched, adsb_only, schedule_only and adsb_total
+    """
+    step_seconds = int(step.total_seconds())
+    window_steps = int(window.total_seconds()) // step_seconds
+    tables = {'matched': matched, 'adsb_only': adsb_only, 'schedule_only': schedule_only}
+    times = np.concatenate([table['time'].to_numpy(dtype=np.int64) for table in tables.values()])
+    if len(times) == 0:
+        return pd.DataFrame(columns=[*tables, 'adsb_total'])
+
+    first = times.min() // step_seconds
+    bins = times.max() // step_seconds - first + 1
+    counts = {name: window_sums(np.bincount(table['time'].to_numpy(dtype=np.int64) // step_seconds - first, minlength=bins),
+                                window_steps)
+              for name, table in tables.items()}
+
+    index = pd.to_datetime((first + np.arange(bins)) * step_seconds, unit='s', utc=True).tz_convert(timezone)
+    result = pd.DataFrame(counts, index=index)
+    result['adsb_total'] = result['matched'] + result['adsb_only']
+    return result.rename_axis('window_start')
+
+
+def busiest_hour_breakdown(rolling):
+    """The window with the most ADS-B movements and how many of them the schedules confirm, as a dict."""
+    start = rolling['adsb_total'].idxmax()
+    return {'window_start': start.isoformat(), **{name: int(count) for name, count in rolling.loc[start].items()}}
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Sliding window counters for movement timestamps
+
+Shared by the ADS-B parser and the scrapers to find the busiest window(s) without
+rescanning all events for every window start.
+"""
+
+from collections import deque
+
+import numpy as np
+
+
+def window_bounds(times, window):
+    """
+    Finds for every timestamp the index range of events in the window [t, t + window).
+
+    :param times: np.ndarray, sorted event timestamps
+    :param window: float, window length in the same unit as times
+    :return: tuple of np.ndarray, (first index in window, first index after window)
+    """
+    starts = np.searchsorted(times, times, side='left')  # Equal timestamps share one window
+    ends = np.searchsorted(times, times + window, side='left')
+    return starts, ends
+
+
+def window_counts(times, starts, window):
+    """
+    Number of events in the window [s, s + window) of every given start s.
+
+    :param times: array-like, event timestamps (unsorted is fine)
+    :param starts: np.ndarray, window starts in the same unit as times
+    :param window: float, window length in the same unit as times
+    :return: np.ndarray of int, count per window start
+    """
+    times = np.sort(np.asarray(times))
+    return np.searchsorted(times, starts + window, side='left') - np.searchsorted(times, starts, side='left')
+
+
+def busiest_windows(times, is_arrival, window, top_k=1):
+    """
+    Finds the top-K non-overlapping windows with the most events.
+
+    Every event timestamp is a candidate window start, just like the original moving window.
+    Candidates are ranked by total count (earliest start on ties) and picked greedily,
+    skipping any window that overlaps one that has already been picked.
+
+    :param times: array-like, event timestamps (unsorted is fine)
+    :param is_arrival: array-like of bool, True for arrivals and False for departures
+    :param window: float, window length in the same unit as times
+    :param top_k: int, maximum number of windows to return
+    :return: list of tuples, (start, arrivals, departures, total) sorted from busiest to least busy
+    """
+    times = np.asarray(times, dtype=np.float64)
+    is_arrival = np.asarray(is_arrival, dtype=bool)
+    if len(times) == 0 or top_k < 1:
+        return []
+
+    # Sort once, everything after this is a searchsorted sweep
+    order = np.argsort(times, kind='stable')
+    times = times[order]
+    is_arrival = is_arrival[order]
+
+    starts, ends = window_bounds(times, window)
+    totals = ends - starts
+    arrivals_cumsum = np.concatenate(([0], np.cumsum(is_arrival)))
+    arrivals = arrivals_cumsum[ends] - arrivals_cumsum[starts]
+
+    # Highest total first, earliest start on ties
+    candidates = np.lexsort((times, -totals))
+
+    selected = []
+    for i in candidates:
+        if all(abs(times[i] - times[j]) >= window for j in selected):
+            selected.append(i)
+            if len(selected) == top_k:
+                break
+
+    return [(float(times[i]), int(arrivals[i]), int(totals[i] - arrivals[i]), int(totals[i])) for i in selected]
+
+
+class OnlineWindowMax:
+    """
+    Busiest window of a time-sorted event stream, updated as the events arrive.
+
+    Windows start at an event like in busiest_windows: the window [t, t + window) of the oldest event t
+    is complete as soon as an event at or after t + window arrives, then t is dropped. Only the events
+    of the current window are kept, so memory is bounded by the window length and the stream can span
+    midnight and several days.
+
+    :param window: float, window length in the same unit as the event times
+    :param day_of: function, start time -> day label to also keep the busiest window per day (by the
+        day the window starts in), or None
+    """
+
+    def __init__(self, window, day_of=None):
+        self.window = window
+        self.day_of = day_of
+        self.events = deque()
+        self.arrivals = 0
+        self.best = None
+        self.best_per_day = {}
+
+    def add(self, time, is_arrival):
+        """Adds the next event, times must not decrease."""
+        while self.events and self.events[0][0] + self.window <= time:
+            self.close_oldest()
+        self.events.append((time, is_arrival))
+        self.arrivals += is_arrival
+
+    def close_oldest(self):
+        """Counts the window of the oldest event and drops that event. The earliest window wins on ties."""
+        start, is_arrival = self.events[0]
+        total = len(self.events)
+        result = (start, self.arrivals, total - self.arrivals, total)
+        if self.best is None or total > self.best[3]:
+            self.best = result
+        if self.day_of is not None:
+            day = self.day_of(start)
+            if day not in self.best_per_day or total > self.best_per_day[day][3]:
+                self.best_per_day[day] = result
+
+        self.events.popleft()
+        self.arrivals -= is_arrival
+
+    def finish(self):
+        """Closes the windows of the events that are left and returns the busiest window, (start, arrivals, departures, total) or None."""
+        while self.events:
+            self.close_oldest()
+        return self.best
+
+
+# %% Minute of day counts
+
+
+def hhmm_to_minutes(times):
+    """
+    Converts 'HH:MM' strings to minute of day integers in one vectorized operation.
+
+    :param times: array-like of str, times in 'HH:MM' format
+    :return: np.ndarray of int, minutes since midnight
+    """
+    times = np.asarray(times, dtype=str)
+    if times.size == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    hhmm = np.char.replace(times, ':', '').astype(np.int64)
+    return hhmm // 100 * 60 + hhmm % 100
+
+
+def window_sums(histogram, window):
+    """
+    Sums histogram[s:s + window] for every start s using a cumulative sum.
+
+    Windows that run past the end of the histogram are cut off at the end.
+
+    :param histogram: np.ndarray, counts per minute
+    :param window: int, window length in minutes
+    :return: np.ndarray, count per window start
+    """
+    cumsum = np.concatenate(([0], np.cumsum(histogram)))
+    starts = np.arange(len(histogram))
+    return cumsum[np.minimum(starts + window, len(histogram))] - cumsum[starts]
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Local stub HTTP server to check the scrapers offline
+
+The server runs in a thread on a free port and answers every path from a table of routes, so the
+retries, the error handling and the parsing of the scrapers can be checked without touching the
+real sites. Running this module checks the fetchers against it.
+"""
+
+from contextlib import contextmanager
+import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import sys
+import tempfile
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+import requests
+
+from Async_fetcher import ResponseCache, fetch_all
+
+
+@contextmanager
+def stub_server(routes):
+    """
+    Serves the routes on 127.0.0.1 for the duration of the with block.
+
+    :param routes: function, path with query -> (status code, text), e.g. a dict's get wrapped to
+        return (404, '') for unknown paths
+    :yield: tuple, (host to pass to the scrapers as 'http://127.0.0.1:<port>', list of the requested paths)
+    """
+    requested = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requested.append(self.path)
+            status, text = routes(self.path)
+            body = text.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}', requested
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def flightera_page(date, times):
+    """Minimal Flightera arrival/departure page with one flight at every 'HH:MM' time, in the columns process_html_data reads."""
+    rows = ''.join(f"<tr><td>{date.strftime('%a, %d. %b %Y')}  {time} CEST  Landed</td><td>KL{1000 + i} AF{2000 + i}</td>"
+                   f"<td>-</td><td>-</td><td>-</td><td>{time} CEST</td><td>{time} CEST</td></tr>"
+                   for i, time in enumerate(times))
+    header = ''.join(f'<th>{column}</th>' for column in range(7))
+    return f'<html><body><table><thead><tr>{header}</tr></thead><tbody>{rows}</tbody></table></body></html>'
+
+
+def check_fetchers():
+    """Checks fetch_all and the Flightera scraper against the stub server, raises AssertionError on a failure."""
+    import Flight_Era
+
+    attempts = {}
+
+    def routes(path):
+        if path == '/ok':
+            return 200, 'ok'
+        if path == '/down':
+            return 503, 'down'
+        if path == '/busy':
+            # Rate limited on the first attempt only
+            attempts[path] = attempts.get(path, 0) + 1
+            return (429, 'slow down') if attempts[path] == 1 else (200, 'ok')
+        if path.startswith('/en/airport/'):
+            return 200, flightera_page(datetime.date(2023, 8, 1), ['08:05', '08:20', '09:10'])
+        return 404, 'not found'
+
+    options = {'rate': 100, 'retries': 2, 'backoff': 0.01}
+    with stub_server(routes) as (host, requested), tempfile.TemporaryDirectory() as cache_dir:
+        cache = ResponseCache(cache_dir)
+
+        pages = fetch_all([(('ok',), host + '/ok'), (('busy',), host + '/busy')], cache=cache, **options)
+        assert pages[('ok',)].text == 'ok' and pages[('busy',)].text == 'ok', pages
+        assert requested.count('/busy') == 2, requested
+
+        # Cached pages are not fetched again
+        requested.clear()
+        fetch_all([(('ok',), host + '/ok')], cache=cache, **options)
+        assert requested == [], requested
+
+        # Server errors raise after the retries, client errors straight away
+        for path, expected_requests in (('/down', options['retries'] + 1), ('/missing', 1)):
+            requested.clear()
+            try:
+                fetch_all([((path,), host + path)], cache=cache, **options)
+            except requests.ConnectionError:
+                pass
+            else:
+                raise AssertionError(f'{path} did not raise')
+            assert requested == [path] * expected_requests, requested
+            assert cache.get((path,)) is None
+
+        # Flightera pages go through the same fetcher and are parsed by process_html_data
+        flightera_cache, Flight_Era.response_cache = Flight_Era.response_cache, cache
+        try:
+            departures, arrivals = Flight_Era.retrieve_data(datetime.date(2023, 8, 1), '08:00', '09:00', host=host, rate=100)
+        finally:
+            Flight_Era.response_cache = flightera_cache
+        assert list(arrivals['time']) == ['08:05', '08:20', '09:10'] * 2, arrivals
+
+    print('Fetchers behave as expected against the stub server')
+
+
+def write_dutch_plane_spotters_fixtures(fixtures_dir, days, flights=600, seed=0):
+    """
+    Writes arrival and departure pages in the layout of Dutch Plane Spotters for every day, as
+    <direction>_<date>.html like the pages cached by Dutch_Plane_Spotters.fetch_html.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(fixtures_dir, exist_ok=True)
+    for day in days:
+        for direction, time_column in (('arrival', 'ETA'), ('departure', 'ETD')):
+            minutes = np.sort(rng.integers(0, 24 * 60, flights))
+            table = pd.DataFrame({time_column: [f'{minute // 60:02d}:{minute % 60:02d}' for minute in minutes],
+                                  'FLIGHTNR': [f'KL{i}' for i in range(flights)],
+                                  'Status': np.where(rng.random(flights) < 0.05, 'Cancelled', 'Landed')})
+            if direction == 'arrival':
+                table.columns = pd.MultiIndex.from_product([['Arrival'], table.columns])
+            with open(os.path.join(fixtures_dir, f'{direction}_{day}.html'), 'w', encoding='utf-8') as file:
+                file.write(table.to_html(index=False))
+
+
+def check_dutch_plane_spotters(fixtures_dir=None, start='2023-03-24', end='2023-03-28'):
+    """
+    Checks the Dutch Plane Spotters sweep against the stub server serving saved pages.
+
+    The pages of the days from start up to and including end ('YYYY-MM-DD') come from fixtures_dir
+    (<direction>_<date>.html, e.g. pages saved by an earlier run), or are generated if it is None.
+    The sweep has to match movements_from_html on the same pages, a day without pages has to keep
+    its earlier entry in the output, a rerun must not fetch the days that have pages again and a
+    sweep with another interval must not reuse the checkpoints. The generated pages leave out the
+    last day.
+    """
+    import Dutch_Plane_Spotters
+
+    start, end = datetime.datetime.strptime(start, '%Y-%m-%d'), datetime.datetime.strptime(end, '%Y-%m-%d')
+    days = Dutch_Plane_Spotters.date_range(start, end)
+    with tempfile.TemporaryDirectory() as work_dir:
+        if fixtures_dir is None:
+            fixtures_dir = os.path.join(work_dir, 'fixtures')
+            write_dutch_plane_spotters_fixtures(fixtures_dir, days[:-1])
+        fixtures = ResponseCache(fixtures_dir)
+        paths = {urlsplit(page).path: direction for direction, page in Dutch_Plane_Spotters.DPS_PAGES.items()}
+
+        def routes(path):
+            direction = paths.get(urlsplit(path).path)
+            html = fixtures.get((direction, parse_qs(urlsplit(path).query).get('date', [''])[0])) if direction else None
+            return (200, html) if html is not None else (404, 'not found')
+
+        # An output from an earlier run with an entry for every day
+        output_path = os.path.join(work_dir, 'max_movement_per_day.json')
+        earlier = {f'{day} 00:00': -1 for day in days}
+        Dutch_Plane_Spotters.write_year_dict(output_path, earlier)
+
+        with stub_server(routes) as (host, requested):
+            def sweep(interval):
+                return Dutch_Plane_Spotters.find_year_movements(
+                    start, end, interval, checkpoint_path=os.path.join(work_dir, 'checkpoints.jsonl'),
+                    output_path=output_path, fetch_workers=2, parse_workers=2, cache_dir=os.path.join(work_dir, 'cache'),
+                    host=host)
+
+            for interval in (1, 5):
+                expected = dict(earlier)
+                for day in days:
+                    arrival_html, departure_html = fixtures.get(('arrival', day)), fixtures.get(('departure', day))
+                    if arrival_html is not None and departure_html is not None:
+                        Dutch_Plane_Spotters.set_day(expected, day, Dutch_Plane_Spotters.movements_from_html(
+                            day, arrival_html, departure_html, interval))
+                expected = dict(sorted(expected.items()))
+
+                year_dict = sweep(interval)
+                assert year_dict == expected, (interval, year_dict, expected)
+                with open(output_path, 'r') as file:
+                    assert json.load(file) == expected, interval
+
+                # Every day with pages is checkpointed and cached now
+                requested.clear()
+                assert sweep(interval) == expected, interval
+                assert not any(key[:10] in requested_path for key, amount in expected.items() if amount >= 0
+                               for requested_path in requested), requested
+
+    print('Dutch Plane Spotters sweep matches the fixtures')
+
+
+if __name__ == '__main__':
+    check_fetchers()
+    # Optionally a directory of saved Dutch Plane Spotters pages, otherwise generated ones are used
+    check_dutch_plane_spotters(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Generator of synthetic ADS-B days in the readsb trace_full layout the parser expects
+
+Aircraft near Schiphol take off from or land on one of the runways, the rest cruise somewhere else
+in Europe. A small share of the airborne points gets a spurious 'ground' altitude, like the real data.
+"""
+
+from datetime import datetime, timezone
+import glob
+import gzip
+import json
+import os
+
+import numpy as np
+
+from ADSB_lol_data_parser import day_file_pattern
+from Airports import SCHIPHOL_RUNWAYS
+
+POINT_INTERVAL = 3  # seconds between trace points
+
+
+def airport_path(runway, points, rng):
+    """Positions, altitudes, ground speeds and vertical rates of a departure along the runway and its extended centre line."""
+    (lat_a, lon_a), (lat_b, lon_b) = runway
+    ground_points = points // 3
+
+    # Fraction along the runway: taxi to the threshold and take-off roll, lift-off halfway, then climb out ~40 km
+    along = np.concatenate((np.linspace(-0.2, 0.5, ground_points, endpoint=False), np.linspace(0.5, 12, points - ground_points)))
+    lat = lat_a + along * (lat_b - lat_a) + rng.normal(0, 0.0001, points)
+    lon = lon_a + along * (lon_b - lon_a) + rng.normal(0, 0.0001, points)
+
+    airborne = along >= 0.5
+    altitude = np.where(airborne, (along - 0.5) * 1000, 0).astype(int)
+    ground_speed = np.where(airborne, 160 + (along - 0.5) * 10, np.clip((along + 0.2) * 220, 15, 150))
+    vertical_rate = np.where(airborne, 2000, 0)
+    return lat, lon, airborne, altitude, ground_speed, vertical_rate
+
+
+def cruise_path(points, rng):
+    """Positions, altitudes, ground speeds and vertical rates of an aircraft cruising far away from Schiphol."""
+    start_lat, start_lon = rng.uniform(40, 50), rng.uniform(-5, 20)
+    heading = rng.uniform(0, 2 * np.pi)
+    distance = np.arange(points) * POINT_INTERVAL * 0.0012  # ~450 kt in degrees per second
+
+    lat = start_lat + distance * np.cos(heading)
+    lon = start_lon + distance * np.sin(heading)
+    airborne = np.ones(points, dtype=bool)
+    altitude = np.full(points, int(rng.integers(300, 400)) * 100)
+    return lat, lon, airborne, altitude, np.full(points, 450.0), np.zeros(points)
+
+
+def trace_point(time_offset, lat, lon, airborne, altitude, ground_speed, vertical_rate, callsign):
+    """One trace point: [seconds after timestamp, lat, lon, altitude, gs, track, flags, vertical rate, details, source, geom altitude, geom rate, ias, roll]."""
+    details = {'flight': callsign, 'type': 'adsb_icao', 'nav_modes': ['autopilot']} if time_offset % 60 == 0 else None
+    return [round(time_offset, 2), round(float(lat), 6), round(float(lon), 6), int(altitude) if airborne else 'ground',
+            round(float(ground_speed), 1), 90.0, 0, int(vertical_rate) if airborne else None, details, 'adsb_icao',
+            int(altitude) + 100 if airborne else None, None, None, None]
+
+
+def generate_day(date, data_dir='Data', aircraft=1000, points_per_trace=500, near_schiphol=0.2, glitch_rate=0.01, seed=0):
+    """
+    Writes a synthetic day of gzipped trace_full_*.json files, in place of the trace files the day had.
+
+    :param date: str, day in 'YYYY.MM.DD' format, like the real data directories
+    :param data_dir: str, root directory, the files go where day_file_pattern(date, data_dir) finds them
+    :param aircraft: int, number of trace files
+    :param points_per_trace: int, number of points in every trace, at most a day of points
+    :param near_schiphol: float, share of the aircraft that take off from or land at Schiphol
+    :param glitch_rate: float, share of the airborne points near Schiphol with a spurious 'ground' altitude
+    :param seed: int, seed of the random generator, the same seed writes the same files
+    :return: dict, number of files and points written
+    """
+    if points_per_trace * POINT_INTERVAL > 86400:
+        raise ValueError(f'A trace of {points_per_trace} points does not fit in a day, '
+                         f'at most {86400 // POINT_INTERVAL} points are {POINT_INTERVAL} seconds apart in a day')
+
+    rng = np.random.default_rng(seed)
+    day_start = datetime.strptime(date, '%Y.%m.%d').replace(tzinfo=timezone.utc).timestamp()
+    traces_dir = os.path.dirname(day_file_pattern(date, data_dir).split('**')[0])
+    runways = list(SCHIPHOL_RUNWAYS.values())
+
+    # Files of an earlier run with more aircraft would otherwise stay part of the day
+    for file_path in glob.glob(day_file_pattern(date, data_dir), recursive=True):
+        os.remove(file_path)
+
+    for index in range(aircraft):
+        icao = f'{0x480000 + index:06x}'
+        callsign = f'KLM{index:04d}'.ljust(8)
+
+        if rng.random() < near_schiphol:
+            runway = runways[rng.integers(len(runways))]
+            path = airport_path(runway if rng.random() < 0.5 else runway[::-1], points_per_trace, rng)
+            if rng.random() < 0.5:
+                path = tuple(column[::-1] for column in path)  # Arrival: the departure flown backwards
+                path = path[:5] + (-path[5],)
+            lat, lon, airborne, altitude, ground_speed, vertical_rate = path
+            airborne = airborne & (rng.random(points_per_trace) >= glitch_rate)
+        else:
+            lat, lon, airborne, altitude, ground_speed, vertical_rate = cruise_path(points_per_trace, rng)
+
+        timestamp = day_start + float(rng.uniform(0, 86400 - points_per_trace * POINT_INTERVAL))
+        points = [trace_point(i * POINT_INTERVAL, *values, callsign)
+                  for i, values in enumerate(zip(lat, lon, airborne, altitude, ground_speed, vertical_rate))]
+
+        # Same layout as readsb: metadata first, then the trace with one point per line
+        header = json.dumps({'icao': icao, 'r': f'PH-{index:03X}', 't': 'B738', 'dbFlags': 0,
+                             'desc': 'BOEING 737-800', 'timestamp': round(timestamp, 3)})
+        trace = ',\n'.join(json.dumps(point, separators=(',', ':')) for point in points)
+
+        file_path = os.path.join(traces_dir, icao[-2:], f'trace_full_{icao}.json')
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with gzip.open(file_path, 'wt', encoding='utf-8') as file:
+            file.write(f'{header[:-1]},\n"trace":[\n{trace}\n]}}')
+
+    return {'files': aircraft, 'points': aircraft * points_per_trace}
+
+
+if __name__ == '__main__':
+    generate_day('2023.08.10', data_dir='Benchmark/Data')
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Sidecar index of the raw trace files of a day, so a query only opens the files that can match
+
+Every file is decoded once to record its icao, time range, lat/lon bounding box and the grid cells
+its trace passes through. The index does not depend on the filter region, so another bounding box
+or airport is answered from the same index. Files whose mtime or size changed are indexed again.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import gzip
+import json
+from operator import itemgetter
+import sys
+
+import numpy as np
+
+from ADSB_cache import file_manifest, load_day, save_day
+
+INDEX_VERSION = 1
+CELL_SIZE = 0.25  # degrees, about 28 km north-south
+
+
+def point_cells(lat, lon, cell_size=CELL_SIZE):
+    """Id of the grid cell of every point, cells are cell_size by cell_size degrees."""
+    rows = np.floor((np.asarray(lat) + 90) / cell_size).astype(np.int64)
+    columns = np.floor((np.asarray(lon) + 180) / cell_size).astype(np.int64)
+    return rows * round(360 / cell_size) + columns
+
+
+def region_cells(bbox_tl, bbox_br, cell_size=CELL_SIZE):
+    """Ids of all grid cells that overlap the bounding box (top left, bottom right)."""
+    rows = np.arange(np.floor((bbox_br[0] + 90) / cell_size), np.floor((bbox_tl[0] + 90) / cell_size) + 1, dtype=np.int64)
+    columns = np.arange(np.floor((bbox_tl[1] + 180) / cell_size), np.floor((bbox_br[1] + 180) / cell_size) + 1, dtype=np.int64)
+    return (rows[:, None] * round(360 / cell_size) + columns).ravel()
+
+
+def index_file(file_path):
+    """Icao, first and last epoch time, lat/lon extent (NaN for an empty trace) and the sorted grid cells of one trace file."""
+    with gzip.open(file_path, 'rb') as file:
+        data = json.loads(file.read())
+
+    trace = data['trace']
+    times = data.get('timestamp', 0) + np.fromiter(map(itemgetter(0), trace), dtype=np.float64, count=len(trace))
+    lat = np.fromiter(map(itemgetter(1), trace), dtype=np.float64, count=len(trace))
+    lon = np.fromiter(map(itemgetter(2), trace), dtype=np.float64, count=len(trace))
+    if not trace:
+        return data['icao'], (np.nan,) * 6, np.array([], dtype=np.int64)
+
+    extent = (times.min(), times.max(), lat.min(), lat.max(), lon.min(), lon.max())
+    return data['icao'], extent, np.unique(point_cells(lat, lon))
+
+
+def index_files(file_paths):
+    """Index a chunk of files. A file that cannot be read gets icao None, it stays a candidate for every query."""
+    entries = []
+    for file_path in file_paths:
+        try:
+            entries.append(index_file(file_path))
+        except Exception as e:
+            print(f"\nCould not index {file_path}: {e}", file=sys.stderr)
+            entries.append((None, (np.nan,) * 6, np.array([], dtype=np.int64)))
+    return entries
+
+
+def build_index(file_pattern, index_path, workers=1, chunk_size=250):
+    """
+    Loads the index of all files matching the pattern, indexing only the new and changed files.
+
+    :param file_pattern: str, glob pattern of the trace_full files, e.g. day_file_pattern(date)
+    :param index_path: str, .npz file the index is kept in
+    :param workers: int, number of processes for indexing, 1 indexes in this process
+    :param chunk_size: int, number of files per task of the process pool
+    :return: dict of arrays with one row per file (path, mtime_ns, size, icao, failed, time_min,
+             time_max, lat_min, lat_max, lon_min, lon_max) and the grid cells of file i in
+             cells[cell_offsets[i]:cell_offsets[i + 1]]
+    """
+    manifest = file_manifest(sorted(glob.glob(file_pattern, recursive=True)))
+    key = f'{INDEX_VERSION}:{CELL_SIZE}'
+
+    # Reuse the entries of files that did not change since the index was written
+    previous = load_day(index_path, key)
+    known = {}
+    if previous is not None:
+        for row, (path, mtime_ns, size) in enumerate(zip(previous['path'].tolist(), previous['mtime_ns'].tolist(),
+                                                         previous['size'].tolist())):
+            known[(path, mtime_ns, size)] = row
+
+    new_files = [path for path, mtime_ns, size in manifest if (path, mtime_ns, size) not in known]
+    chunks = [new_files[i:i + chunk_size] for i in range(0, len(new_files), chunk_size)]
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            new_entries = [entry for chunk_entries in executor.map(index_files, chunks) for entry in chunk_entries]
+    else:
+        new_entries = [entry for chunk in chunks for entry in index_files(chunk)]
+    new_entries = dict(zip(new_files, new_entries))
+
+    entries = []
+    for path, mtime_ns, size in manifest:
+        row = known.get((path, mtime_ns, size))
+        if row is None:
+            entries.append(new_entries[path])
+        else:
+            cells = previous['cells'][previous['cell_offsets'][row]:previous['cell_offsets'][row + 1]]
+            extent = tuple(previous[name][row] for name in ('time_min', 'time_max', 'lat_min', 'lat_max', 'lon_min', 'lon_max'))
+            entries.append((None if previous['failed'][row] else str(previous['icao'][row]), extent, cells))
+
+    extents = np.array([extent for _, extent, _ in entries], dtype=np.float64).reshape(-1, 6)
+    index = {
+        'path': np.array([path for path, _, _ in manifest], dtype=str),
+        'mtime_ns': np.array([mtime_ns for _, mtime_ns, _ in manifest], dtype=np.int64),
+        'size': np.array([size for _, _, size in manifest], dtype=np.int64),
+        'icao': np.array([icao or '' for icao, _, _ in entries], dtype=str),
+        'failed': np.array([icao is None for icao, _, _ in entries], dtype=bool),
+        'cell_offsets': np.concatenate(([0], np.cumsum([len(cells) for _, _, cells in entries], dtype=np.int64))),
+        'cells': np.concatenate([cells for _, _, cells in entries] + [np.array([], dtype=np.int64)]),
+    }
+    for column, name in enumerate(('time_min', 'time_max', 'lat_min', 'lat_max', 'lon_min', 'lon_max')):
+        index[name] = extents[:, column]
+
+    if new_files or previous is None or len(previous['path']) != len(manifest):
+        save_day(index_path, index, key)
+        print(f"Indexed {len(new_files)} new or changed files, {len(manifest)} files in {index_path}")
+
+    return index
+
+
+def query_index(index, bbox_tl, bbox_br, start_time=None, end_time=None):
+    """
+    Files that can have points inside the bounding box, in file order.
+
+    A file is a candidate if its trace passes through a grid cell that overlaps the box and, with a
+    time window, if its time range overlaps [start_time, end_time] (epoch seconds). Files that could
+    not be indexed are always candidates, so their errors still show up when they are filtered.
+
+    :param index: dict, result of build_index
+    :param bbox_tl: (lat, lon), top left corner of the box
+    :param bbox_br: (lat, lon), bottom right corner of the box
+    :return: list of str, paths of the candidate files
+    """
+    offsets = index['cell_offsets']
+    cell_file = np.repeat(np.arange(len(index['path'])), np.diff(offsets))
+    candidates = np.zeros(len(index['path']), dtype=bool)
+    candidates[cell_file[np.isin(index['cells'], region_cells(bbox_tl, bbox_br))]] = True
+
+    if start_time is not None:
+        candidates &= ~(index['time_max'] < start_time)
+    if end_time is not None:
+        candidates &= ~(index['time_min'] > end_time)
+
+    return index['path'][candidates | index['failed']].tolist()
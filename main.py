@@ -6,7 +6,153 @@ Big code to answer the question "What is the maximum number of take-offs and lan
 Created on Sun Jan 28 15:55:41 2024
 
 @author: Max & Jens
+
+Command line entry point, e.g.
+
+    python main.py ingest --start 2023-08-01 --end 2023-08-31 --workers 8
+    python main.py analyze --start 2023-01-01 --end 2023-12-31 --workers 8
+    python main.py scrape dps --start 2023-01-01 --end 2023-12-31
+    python main.py airports --start 2023-08-01 --end 2023-08-01 --airports EHAM EHRD EHEH
+    python main.py report
+
+Every subcommand imports the modules it needs itself, so the command line starts without loading
+pandas, matplotlib, requests or fake_http_header.
 """
 
-import numpy as np
-import pandas as pd
+import argparse
+from datetime import datetime
+import os
+import sys
+
+from Day_checkpoints import date_range, load_checkpoints
+
+
+def parse_date(text):
+    return datetime.strptime(text, '%Y-%m-%d')
+
+
+def ingest(args):
+    """Filter the raw ADS-B files of every day into the cache (and the sidecar index with --index)."""
+    from ADSB_lol_data_parser import load_or_filter_day
+
+    for date in date_range(args.start, args.end, '%Y.%m.%d'):
+        try:
+            load_or_filter_day(date, workers=args.workers, parser=args.parser, use_index=args.index)
+        except Exception as e:
+            print(f"\nFailed to ingest {date}: {type(e).__name__}: {e}", file=sys.stderr)
+
+
+def analyze(args):
+    """Find the busiest hour in the ADS-B data of the date range."""
+    from ADSB_lol_data_parser import analyze_days
+
+    analyze_days(args.start.strftime('%Y-%m-%d'), args.end.strftime('%Y-%m-%d'), workers=args.workers, estimate=args.estimate,
+                 timezone=args.timezone, use_geofence=args.geofence)
+
+
+def scrape(args):
+    """Find the busiest hour of every day in the schedules of Flightera or Dutch Plane Spotters."""
+    if args.source == 'flightera':
+        import Flight_Era
+
+        Flight_Era.find_max_movements(args.start.date(), args.end.date(), args.start_hour, args.end_hour, args.interval,
+                                      timezone=args.timezone, concurrency=args.workers, airport=args.airport)
+    else:
+        import Dutch_Plane_Spotters
+
+        year_dict = Dutch_Plane_Spotters.find_year_movements(args.start, args.end, args.interval, parse_workers=args.workers,
+                                                             timezone=args.timezone)
+        if args.plot:
+            Dutch_Plane_Spotters.plot_year(year_dict)
+
+
+def airports(args):
+    """Count the movements and busiest hour of several airports in one pass over the ADS-B data of every day."""
+    from Airports import AIRPORTS
+    from Multi_airport import analyze_airports
+
+    for date in date_range(args.start, args.end, '%Y.%m.%d'):
+        analyze_airports(date, [AIRPORTS[icao] for icao in args.airports], workers=args.workers, use_geofence=args.geofence,
+                         use_index=args.index)
+
+
+def report(args):
+    """Print the busiest hour found so far by every source, from the checkpoint files."""
+    sources = {'ADS-B': (args.adsb_checkpoints, 'total movements', 'busiest hour'),
+               'Dutch Plane Spotters': (args.dps_checkpoints, 'Movement_amount', 'Time')}
+
+    for source, (checkpoint_path, amount, time) in sources.items():
+        checkpoints = load_checkpoints(checkpoint_path)
+        if not checkpoints:
+            print(f"{source}: no days in {checkpoint_path}")
+            continue
+        best = max(checkpoints.values(), key=lambda record: record['result'][amount])
+        print(f"{source}: {best['result'][amount]} movements in the hour starting at {best['result'][time]}, day "
+              f"{best['day']} ({len(checkpoints)} days analysed)")
+
+    if args.flightaware:
+        from Flightaware_per_hour import load_flightaware, top_days
+
+        print(top_days(load_flightaware(), args.top, start=args.flightaware_start, end=args.flightaware_end))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip(), formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_range(subparser):
+        subparser.add_argument('--start', type=parse_date, default=parse_date('2023-01-01'), help='first day, YYYY-MM-DD')
+        subparser.add_argument('--end', type=parse_date, default=parse_date('2023-12-31'), help='last day, YYYY-MM-DD')
+        subparser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes or concurrent requests')
+
+    ingest_parser = subparsers.add_parser('ingest', help=ingest.__doc__)
+    add_range(ingest_parser)
+    ingest_parser.add_argument('--parser', choices=['json', 'stream'], default='json', help='trace file parser backend')
+    ingest_parser.add_argument('--index', action='store_true', help='only open the files the sidecar index selects')
+    ingest_parser.set_defaults(run=ingest)
+
+    analyze_parser = subparsers.add_parser('analyze', help=analyze.__doc__)
+    add_range(analyze_parser)
+    analyze_parser.add_argument('--estimate', action='store_true',
+                                help='prune days on the schedule maximum plus slack, faster but not guaranteed exact')
+    analyze_parser.add_argument('--geofence', action='store_true', help='only count transitions on the runway zones')
+    analyze_parser.add_argument('--timezone', default='Europe/Amsterdam', help="clock of the reported hours, e.g. 'UTC'")
+    analyze_parser.set_defaults(run=analyze)
+
+    scrape_parser = subparsers.add_parser('scrape', help=scrape.__doc__)
+    scrape_parser.add_argument('source', choices=['flightera', 'dps'])
+    add_range(scrape_parser)
+    scrape_parser.add_argument('--interval', type=int, default=1, help='minutes between window starts')
+    scrape_parser.add_argument('--start-hour', type=int, default=4, help='first hour of the day (flightera)')
+    scrape_parser.add_argument('--end-hour', type=int, default=12, help='last hour of the day (flightera)')
+    scrape_parser.add_argument('--timezone', default='Europe/Amsterdam', help="clock of the reported hours, e.g. 'UTC'")
+    scrape_parser.add_argument('--airport', default='EHAM', help='ICAO code of the airport (flightera)')
+    scrape_parser.add_argument('--plot', action='store_true', help='plot the busiest hour of every day (dps)')
+    scrape_parser.set_defaults(run=scrape)
+
+    airports_parser = subparsers.add_parser('airports', help=airports.__doc__)
+    add_range(airports_parser)
+    airports_parser.add_argument('--airports', nargs='+', default=['EHAM', 'EHRD', 'EHEH'], help='ICAO codes from Airports.py')
+    airports_parser.add_argument('--geofence', action='store_true', help='only count transitions on the runway zones')
+    airports_parser.add_argument('--index', action='store_true', help='only open the files the sidecar index selects')
+    airports_parser.set_defaults(run=airports)
+
+    report_parser = subparsers.add_parser('report', help=report.__doc__)
+    report_parser.add_argument('--adsb-checkpoints', default='Checkpoints/adsb_days.jsonl')
+    report_parser.add_argument('--dps-checkpoints', default='Checkpoints/dutch_plane_spotters.jsonl')
+    report_parser.add_argument('--flightaware', action='store_true', help='also list the busiest FlightAware days')
+    report_parser.add_argument('--flightaware-start', default='2023-01-01')
+    report_parser.add_argument('--flightaware-end', default='2023-12-31')
+    report_parser.add_argument('--top', type=int, default=5)
+    report_parser.set_defaults(run=report)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()